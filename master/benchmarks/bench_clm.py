@@ -0,0 +1,161 @@
+"""
+Benchmark of clm_service requests against the local fake ClickMeeting API (benchmarks/fake_clm_server.py).
+Sends --requests requests of one operation with each level of concurrency through clm_async client and prints
+ throughput, p50 and p99 latency and the number of failed requests. Latency includes retries and waiting
+ for a free connection, but not waiting for a thread of the client.
+The fake server is started in a separate process, unless --url of a running server is given.
+The database is not used: the account is put into the cache of clm_service.
+Usage (from the master directory, with the same environment as for run.py):
+    $ python -m benchmarks.bench_clm --operation autologin --latency 0.05 --concurrency 1 4 16 64
+Connection pool size and retries are taken from the configuration, for example:
+    $ CLM_POOL_SIZE=64 CLM_RETRIES=0 python -m benchmarks.bench_clm --error-rate 0.05
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import time
+
+from lectarium_app import app, clm_service
+from lectarium_app.clm_async import AsyncClmClient
+from lectarium_app.exceptions import ClmOperationalError
+from lectarium_app.models.webinar_entities import CmAccount
+from lectarium_app.utils import RateLimiter
+
+LOGIN = 'benchmark'
+
+
+def start_server(port, latency, jitter, error_rate, tokens_limit):
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_clm_server', '--port', str(port),
+                                '--latency', str(latency), '--jitter', str(jitter), '--error-rate', str(error_rate),
+                                '--tokens-limit', str(tokens_limit), '--seed', '0'], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('Fake ClickMeeting server has not started')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_account():
+    snapshot = clm_service.CmAccountSnapshot(**{name: None for name in clm_service.CmAccountSnapshot._fields})
+    snapshot = snapshot._replace(login=LOGIN, api_key='benchmark', status=1, userplan=1000)
+    clm_service._accounts_cache.put((CmAccount, LOGIN), snapshot)
+
+
+def retrying(func, *args, attempts=10):
+    # POST requests are not retried by clm_service, but the benchmark should not fail on a random error of the server
+    for attempt in range(attempts):
+        try:
+            return func(*args)
+        except ClmOperationalError:
+            if attempt == attempts - 1:
+                raise
+
+
+def prepare_room(tokens):
+    """
+    :return: pair (room id, list of tokens of the room)
+    """
+    response = retrying(clm_service.post_conference, {
+        'name': 'benchmark', 'is_closed': False, 'description': '', 'start_date': '2030-01-01T12:00:00',
+        'duration': '1:00', 'cm_account_login': LOGIN,
+    })
+    room_id = response['room']['id']
+    return room_id, retrying(clm_service.generate_tokens, room_id, LOGIN, tokens)
+
+
+def operations(room_id, tokens):
+    """
+    :return dict: name of the operation -> function of request number, which sends one request
+    """
+    def autologin(n):
+        params = {'email': 'user{}@lectarium.ru'.format(n), 'nickname': 'Студент {}'.format(n),
+                  'role': 'listener', 'token': tokens[n % len(tokens)]}
+        return clm_service.request_autologin_hash(LOGIN, room_id, params)
+
+    return {
+        'autologin': autologin,
+        'get_tokens': lambda n: clm_service.get_tokens(room_id, LOGIN),
+        'generate': lambda n: clm_service.generate_tokens(room_id, LOGIN, 1),
+        'edit': lambda n: clm_service.edit_conference(room_id, LOGIN, {'name': 'benchmark {}'.format(n)}),
+    }
+
+
+def timed(func, n):
+    start = time.perf_counter()
+    try:
+        func(n)
+    except Exception as e:
+        return time.perf_counter() - start, e
+    return time.perf_counter() - start, None
+
+
+def percentile(sorted_values, share):
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+def measure(func, requests, concurrency):
+    """
+    :return: tuple (requests per second, p50 in seconds, p99 in seconds, number of errors)
+    """
+    client = AsyncClmClient(concurrency)
+    start = time.perf_counter()
+    results = client.run_many(timed, [(func, n) for n in range(requests)])
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(error is not None for _, error in results)
+    return requests / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operation', default='autologin', choices=('autologin', 'get_tokens', 'generate', 'edit'))
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests for each concurrency')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--url', help='Base url of a running fake server, like http://127.0.0.1:8085/v1')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean delay of the started server, seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Deviation of the delay, seconds')
+    parser.add_argument('--error-rate', type=float, default=0., help='Share of 503 responses of the started server')
+    parser.add_argument('--tokens-limit', type=int, default=100000, help='Limit of tokens of a room')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Requests per second of the account, 0 disables the rate limiter (CLM_RATE_LIMIT)')
+    args = parser.parse_args()
+
+    process = None
+    if args.url is None:
+        port = free_port()
+        process = start_server(port, args.latency, args.jitter, args.error_rate, args.tokens_limit)
+        args.url = 'http://127.0.0.1:{}/v1'.format(port)
+    try:
+        app.config['CLM_URL'] = args.url.rstrip('/')
+        clm_service.rate_limiter = RateLimiter(args.rate_limit, app.config['CLM_RATE_BURST'])
+        with app.app_context():
+            prepare_account()
+            room_id, tokens = prepare_room(100)
+            func = operations(room_id, tokens)[args.operation]
+
+            print('{} x {} against {}, pool size {}, retries {}'.format(
+                args.operation, args.requests, args.url, app.config['CLM_POOL_SIZE'], app.config['CLM_RETRIES']))
+            print('{:>12} {:>10} {:>10} {:>10} {:>8}'.format('concurrency', 'req/s', 'p50, ms', 'p99, ms', 'errors'))
+            for concurrency in args.concurrency:
+                throughput, p50, p99, errors = measure(func, args.requests, concurrency)
+                print('{:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}'.format(
+                    concurrency, throughput, p50 * 1e3, p99 * 1e3, errors))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Micro-benchmark of FilterParser.tokens_stream.
+Generates filters with N OR-clauses and prints time per clause. Linear tokenizer keeps the last column constant.
+Usage (from the master directory, with the same environment as for run.py):
+    $ python -m benchmarks.bench_tokenizer
+"""
+import timeit
+
+from lectarium_app.utils._parser import FilterParser
+
+
+def make_filter(clauses):
+    return ' OR '.join('webinar_id EQ "{}"'.format(i) for i in range(clauses))
+
+
+def main(sizes=(10, 100, 1000, 5000, 20000), repeat=5):
+    parser = FilterParser()
+    print('{:>8} {:>12} {:>16}'.format('clauses', 'total, ms', 'per clause, us'))
+    for size in sizes:
+        line = make_filter(size)
+        number = max(1, 20000 // size)
+        best = min(timeit.repeat(lambda: list(parser.tokens_stream(line)), number=number, repeat=repeat)) / number
+        print('{:>8} {:>12.3f} {:>16.3f}'.format(size, best * 1e3, best / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
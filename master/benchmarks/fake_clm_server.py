@@ -0,0 +1,219 @@
+"""
+Local stand-in for ClickMeeting API with the requests used by clm_service: conferences, tokens and autologin hashes.
+State is kept in memory. Each response is delayed by --latency +- --jitter seconds, a share (--error-rate) of
+ responses fails with 503. Token generation is answered with 403, as by ClickMeeting, when the room would have
+ more than --tokens-limit tokens.
+Usage (from the master directory):
+    $ python -m benchmarks.fake_clm_server --port 8085 --latency 0.05 --jitter 0.02 --error-rate 0.01
+    $ CLM_URL=http://127.0.0.1:8085/v1 python run.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeClickMeeting:
+    """
+    Rooms and tokens of the fake API. Methods are called by the request handler with parsed form parameters
+     and return pairs (status code, JSON-serializable body).
+    """
+    def __init__(self, latency=0., jitter=0., error_rate=0., tokens_limit=1000, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tokens_limit = tokens_limit
+        self.rooms = {}  # room id -> room, tokens of the room are stored in the room under 'tokens' key
+        self._next_id = 1
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = []  # pairs (method, path) of all received requests, for tests
+        # (method, regular expression of the path) -> handler
+        self.routes = [
+            ('POST', r'/conferences', self.post_conference),
+            ('GET', r'/conferences/(\d+)', self.get_conference),
+            ('PUT', r'/conferences/(\d+)', self.edit_conference),
+            ('DELETE', r'/conferences/(\d+)', self.delete_conference),
+            ('POST', r'/conferences/(\d+)/tokens', self.generate_tokens),
+            ('GET', r'/conferences/(\d+)/tokens', self.get_tokens),
+            ('POST', r'/conferences/(\d+)/room/autologin_hash', self.autologin_hash),
+        ]
+
+    @staticmethod
+    def error(status, message):
+        return status, {'errors': [{'message': message}]}
+
+    def delay(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fails(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def handle(self, method, path, params):
+        """
+        :param str path: path without the version prefix and .json suffix, like /conferences/1/tokens
+        :param dict params: form parameters of the request
+        :return: pair (status code, body)
+        """
+        with self._lock:
+            self.requests.append((method, path))
+        self.delay()
+        if self.fails():
+            return self.error(503, 'Service temporarily unavailable')
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                with self._lock:
+                    return handler(params, *[int(group) for group in match.groups()])
+        return self.error(404, 'Not found')
+
+    @staticmethod
+    def _public(room):
+        return {key: value for key, value in room.items() if key != 'tokens'}
+
+    def post_conference(self, params):
+        if not params.get('name'):
+            return self.error(400, 'Name is required')
+        room_id = self._next_id
+        self._next_id += 1
+        self.rooms[room_id] = {
+            'id': room_id,
+            'name': params['name'],
+            'room_type': params.get('room_type', 'webinar'),
+            'starts_at': params.get('starts_at'),
+            'room_url': 'http://fake-clickmeeting.local/{}'.format(room_id),
+            'tokens': [],
+        }
+        return 201, {'room': self._public(self.rooms[room_id])}
+
+    def get_conference(self, params, room_id):
+        if room_id not in self.rooms:
+            return self.error(404, 'Room not found')
+        return 200, {'conference': self._public(self.rooms[room_id])}
+
+    def edit_conference(self, params, room_id):
+        if room_id not in self.rooms:
+            return self.error(404, 'Room not found')
+        room = self.rooms[room_id]
+        room.update((key, params[key]) for key in ('name', 'lobby_description') if key in params)
+        return 200, {'room': self._public(room)}
+
+    def delete_conference(self, params, room_id):
+        if self.rooms.pop(room_id, None) is None:
+            return self.error(404, 'Room not found')
+        return 200, {'result': 'OK'}
+
+    def generate_tokens(self, params, room_id):
+        if room_id not in self.rooms:
+            return self.error(404, 'Room not found')
+        tokens = self.rooms[room_id]['tokens']
+        how_many = int(params.get('how_many', 1))
+        if len(tokens) + how_many > self.tokens_limit:
+            # The same words as in the message of ClickMeeting, see clm_service.parse_token_limit
+            return self.error(403, 'Unable to generate more tokens for this conference, {} tokens are generated, '
+                                   '{} requested and limit is {}'.format(len(tokens), how_many, self.tokens_limit))
+        new_tokens = [{'token': uuid.uuid4().hex[:12].upper(), 'sent_to_email': None, 'first_use_date': None}
+                      for _ in range(how_many)]
+        tokens.extend(new_tokens)
+        return 201, {'access_tokens': new_tokens}
+
+    def get_tokens(self, params, room_id):
+        if room_id not in self.rooms:
+            return self.error(404, 'Room not found')
+        return 200, {'access_tokens': list(self.rooms[room_id]['tokens'])}
+
+    def autologin_hash(self, params, room_id):
+        if room_id not in self.rooms:
+            return self.error(404, 'Room not found')
+        if not any(token['token'] == params.get('token') for token in self.rooms[room_id]['tokens']):
+            return self.error(400, 'Invalid token')
+        key = '{}:{}:{}'.format(room_id, params.get('token'), params.get('email'))
+        return 200, {'autologin_hash': hashlib.sha1(key.encode()).hexdigest()}
+
+
+class FakeClickMeetingHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, as with the real API, so that the connection pool of clm_service is used
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle's algorithm each response would wait for delayed ACK
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        params = dict(urllib.parse.parse_qsl(url.query))
+        params.update(urllib.parse.parse_qsl(body))
+
+        match = re.fullmatch(r'/v1(/.*)\.json', url.path)
+        if not self.headers.get('X-Api-Key'):
+            status, response = FakeClickMeeting.error(401, 'X-Api-Key header is required')
+        elif match is None:
+            status, response = FakeClickMeeting.error(404, 'Not found')
+        else:
+            status, response = self.server.fake.handle(self.command, match.group(1), params)
+
+        content = json.dumps(response).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client has gone, for example after its read timeout
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8085, verbose=False, **options):
+    """
+    :param options: parameters of FakeClickMeeting
+    :return ThreadingHTTPServer: server with FakeClickMeeting in `fake` attribute. Call serve_forever to start it.
+    """
+    server = ThreadingHTTPServer((host, port), FakeClickMeetingHandler)
+    server.daemon_threads = True
+    server.fake = FakeClickMeeting(**options)
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--latency', type=float, default=0., help='Mean delay of responses, seconds')
+    parser.add_argument('--jitter', type=float, default=0., help='Maximal deviation of the delay, seconds')
+    parser.add_argument('--error-rate', type=float, default=0., help='Share of responses failed with 503')
+    parser.add_argument('--tokens-limit', type=int, default=1000, help='Maximal number of tokens of a room')
+    parser.add_argument('--seed', type=int, help='Seed of delays and errors')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.verbose, latency=args.latency, jitter=args.jitter,
+                         error_rate=args.error_rate, tokens_limit=args.tokens_limit, seed=args.seed)
+    print('Fake ClickMeeting API is listening on http://{}:{}/v1'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # In fact, it is not required, but "Explicit is better than implicit."
@@ -21,6 +22,65 @@ class Config(object):
     PROPAGATE_EXCEPTIONS = False
 
     LOGGER_LEVEL = os.getenv('LOGGER_LEVEL', 'INFO')
+
+    # Number of parsed filter strings kept by PaginationMixin. Zero disables the cache.
+    FILTER_CACHE_SIZE = int(os.getenv('FILTER_CACHE_SIZE', '256'))
+    # Total counts of filtered collections. Writes in other processes are not visible until TTL (seconds) expires.
+    COUNT_CACHE_SIZE = int(os.getenv('COUNT_CACHE_SIZE', '256'))
+    COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', '60'))
+    # Number of rows read from the database at once by streaming responses and exports
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+    # Maximal number of ids in one request to batch endpoints like GET /webinars/batch
+    BATCH_FETCH_MAX_IDS = int(os.getenv('BATCH_FETCH_MAX_IDS', '200'))
+    # Maximal number of objects in one request to bulk endpoints like POST /webinars/planned/bulk
+    BULK_MAX_SIZE = int(os.getenv('BULK_MAX_SIZE', '1000'))
+    # Number of rows in one Arrow record batch or Parquet row group
+    COLUMNAR_BATCH_SIZE = int(os.getenv('COLUMNAR_BATCH_SIZE', '10000'))
+
+    # Background exports: directory for exported files and their lifetime in seconds.
+    # Identical exports requested within EXPORT_TTL reuse the existing file.
+    EXPORT_SPOOL_DIR = os.getenv('EXPORT_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'lectarium_exports'))
+    EXPORT_TTL = float(os.getenv('EXPORT_TTL', '600'))
+    # Cache of list responses: 'local' (memory of one process) or 'redis' (shared by all processes, see
+    #  RESPONSE_CACHE_URL). Responses are invalidated on every write, TTL (seconds) limits memory usage only.
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'local')
+    RESPONSE_CACHE_URL = os.getenv('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '300'))
+
+    # Base url of ClickMeeting API. benchmarks/fake_clm_server.py is a local stand-in for tests and benchmarks.
+    CLM_URL = os.getenv('CLM_URL', 'https://api.clickmeeting.com/v1').rstrip('/')
+    # ClickMeeting API client: timeouts (seconds) of each request, size of the connection pool of one process and
+    #  retries of idempotent requests (GET, PUT, DELETE) after connection errors and 502-504 responses.
+    # Delay before n-th retry is CLM_RETRY_BACKOFF * 2 ** (n - 1) seconds.
+    CLM_CONNECT_TIMEOUT = float(os.getenv('CLM_CONNECT_TIMEOUT', '3.05'))
+    CLM_READ_TIMEOUT = float(os.getenv('CLM_READ_TIMEOUT', '30'))
+    CLM_POOL_SIZE = int(os.getenv('CLM_POOL_SIZE', '10'))
+    # Maximal number of simultaneous requests of clm_async client. Should not exceed CLM_POOL_SIZE.
+    CLM_CONCURRENCY = int(os.getenv('CLM_CONCURRENCY', os.getenv('CLM_POOL_SIZE', '10')))
+    CLM_RETRIES = int(os.getenv('CLM_RETRIES', '3'))
+    CLM_RETRY_BACKOFF = float(os.getenv('CLM_RETRY_BACKOFF', '0.5'))
+    # Outbound requests to ClickMeeting per account: requests per second, burst and maximal time (seconds) a request
+    #  waits in the queue before RateLimitExceeded. Each retry is counted as a separate request. Zero rate disables
+    #  limiting.
+    CLM_RATE_LIMIT = float(os.getenv('CLM_RATE_LIMIT', '5'))
+    CLM_RATE_BURST = int(os.getenv('CLM_RATE_BURST', '10'))
+    CLM_RATE_QUEUE_TIMEOUT = float(os.getenv('CLM_RATE_QUEUE_TIMEOUT', '10'))
+    # Token pools of webinars are refilled in background by batches of TOKEN_POOL_REFILL_BATCH tokens, when the number
+    #  of free tokens drops below the low watermark, up to the high watermark (or the limit of the room).
+    TOKEN_POOL_LOW_WATERMARK = int(os.getenv('TOKEN_POOL_LOW_WATERMARK', '20'))
+    TOKEN_POOL_HIGH_WATERMARK = int(os.getenv('TOKEN_POOL_HIGH_WATERMARK', '100'))
+    TOKEN_POOL_REFILL_BATCH = int(os.getenv('TOKEN_POOL_REFILL_BATCH', '50'))
+    # Retry-After of the response to a user, who asks for a token while the pool of the webinar is empty
+    TOKEN_CLAIM_RETRY_AFTER = int(os.getenv('TOKEN_CLAIM_RETRY_AFTER', '5'))
+    # Autologin hashes of users are requested from ClickMeeting in advance by batches of this size. A failed request
+    #  is repeated not earlier than AUTOLOGIN_HASH_RETRY_INTERVAL (seconds) later.
+    AUTOLOGIN_HASH_BATCH_SIZE = int(os.getenv('AUTOLOGIN_HASH_BATCH_SIZE', '200'))
+    AUTOLOGIN_HASH_RETRY_INTERVAL = float(os.getenv('AUTOLOGIN_HASH_RETRY_INTERVAL', '600'))
+    # Cached CmAccount and VimeoAccount rows. Changes made by other processes are visible after TTL (seconds).
+    ACCOUNT_CACHE_SIZE = int(os.getenv('ACCOUNT_CACHE_SIZE', '64'))
+    ACCOUNT_CACHE_TTL = float(os.getenv('ACCOUNT_CACHE_TTL', '300'))
+
     # flask reloader sets variable WERKZEUG_RUN_MAIN for the second instance.
     # Second instance will be launched in the following cases:
     #  $ FLASK_ENV=development flask run
@@ -0,0 +1,98 @@
+"""
+Асинхронный клиент ClickMeeting с тем же набором операций, что и clm_service.
+Запросы выполняются в пуле потоков через общий пул соединений clm_service (см. get_http_session),
+ одновременно выполняется не больше CLM_CONCURRENCY запросов.
+Синхронный код может выполнять много операций конкурентно через `run_many`.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lectarium_app import app, clm_service
+
+
+class AsyncClmClient:
+    def __init__(self, concurrency=None):
+        """
+        :param int concurrency: maximal number of simultaneous requests. Defaults to CLM_CONCURRENCY.
+        """
+        self.concurrency = concurrency or app.config['CLM_CONCURRENCY']
+        self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='clm')
+        # Semaphore belongs to an event loop, so each loop gets its own one
+        self._semaphores = {}
+
+    def _semaphore(self):
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    @staticmethod
+    def _in_app_context(func, args, kwargs):
+        # Worker threads need application context for configuration and database access
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Runs blocking function in the thread pool, waiting for a free slot if the limit of requests is reached.
+        """
+        async with self._semaphore():
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._executor, self._in_app_context, func, args, kwargs)
+
+    async def post_conference(self, data):
+        return await self.call(clm_service.post_conference, data)
+
+    async def edit_conference(self, room_id, cm_account_login, data):
+        return await self.call(clm_service.edit_conference, room_id, cm_account_login, data)
+
+    async def delete_conference(self, room_id, cm_account_login):
+        return await self.call(clm_service.delete_conference, room_id, cm_account_login)
+
+    async def generate_and_get_tokens(self, room_id, cm_account_login, how_many):
+        return await self.call(clm_service.generate_and_get_tokens, room_id, cm_account_login, how_many)
+
+    async def get_autologin_hash(self, lect_user, webinar, token):
+        # lect_user and webinar are used in another thread, so their attributes should be loaded beforehand
+        return await self.call(clm_service.get_autologin_hash, lect_user, webinar, token)
+
+    def run_many(self, func, args_list, return_exceptions=True):
+        """
+        Synchronous facade. Calls func for each tuple of arguments concurrently and waits for all results.
+        :param func: blocking function, like clm_service.delete_conference, or coroutine function of this client
+        :param args_list: iterable of tuples with arguments
+        :param bool return_exceptions: put exceptions into results instead of raising the first of them
+        :return list: results in order of args_list
+        """
+        async def run():
+            if asyncio.iscoroutinefunction(func):
+                calls = [func(*args) for args in args_list]
+            else:
+                calls = [self.call(func, *args) for args in args_list]
+            return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            self._semaphores.pop(loop, None)
+            loop.close()
+
+
+# pid -> AsyncClmClient. Threads of the pool are not inherited by forked processes
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_clm_client():
+    """
+    Returns AsyncClmClient shared by all threads of the current process.
+    """
+    pid = os.getpid()
+    with _clients_lock:
+        if pid not in _clients:
+            _clients.clear()
+            _clients[pid] = AsyncClmClient()
+        return _clients[pid]
@@ -5,13 +5,80 @@ import urllib.request
 import datetime
 
 import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
 import requests
+from requests.adapters import HTTPAdapter
 
-from lectarium_app.exceptions import ClmOperationalError
+from lectarium_app.exceptions import ClmOperationalError, TokenLimitError
 from lectarium_app import webinar_service
-from lectarium_app import logger
+from lectarium_app import app, logger, session
+from lectarium_app.models.webinar_entities import CmAccount, VimeoAccount
+from lectarium_app.utils import LRUCache, RateLimiter
 
-cm_url = 'https://api.clickmeeting.com/v1'
+# pid -> requests.Session, see get_http_session
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+# Все запросы к ClickMeeting проходят через ограничитель частоты, ключ - логин учетной записи
+rate_limiter = RateLimiter(app.config['CLM_RATE_LIMIT'], app.config['CLM_RATE_BURST'])
+
+# Неизменяемые копии строк учетных записей: они не привязаны к сессии sqlalchemy и безопасны для всех потоков
+CmAccountSnapshot = namedtuple('CmAccountSnapshot', [column.name for column in CmAccount.__table__.columns])
+VimeoAccountSnapshot = namedtuple('VimeoAccountSnapshot', [column.name for column in VimeoAccount.__table__.columns])
+_snapshot_types = {CmAccount: CmAccountSnapshot, VimeoAccount: VimeoAccountSnapshot}
+# (model, login) -> snapshot. Учетные записи почти не меняются, а нужны перед каждым запросом к ClickMeeting
+_accounts_cache = LRUCache(app.config['ACCOUNT_CACHE_SIZE'], ttl=app.config['ACCOUNT_CACHE_TTL'])
+
+
+def _load_account(model, login):
+    account = model.query.get(login)
+    if account is None:
+        raise ClmOperationalError('{} {} not found'.format(model.__name__, login))
+    snapshot_type = _snapshot_types[model]
+    return snapshot_type(*[getattr(account, name) for name in snapshot_type._fields])
+
+
+def get_cm_account(login):
+    """
+    Returns cached copy of CmAccount row. The database is queried at most once in ACCOUNT_CACHE_TTL seconds.
+    :return CmAccountSnapshot: named tuple with the same fields as CmAccount
+    """
+    return _accounts_cache.get_or_create((CmAccount, login), lambda: _load_account(CmAccount, login))
+
+
+def get_vimeo_account(login):
+    """
+    Returns cached copy of VimeoAccount row, see `get_cm_account`.
+    :return VimeoAccountSnapshot: named tuple with the same fields as VimeoAccount
+    """
+    return _accounts_cache.get_or_create((VimeoAccount, login), lambda: _load_account(VimeoAccount, login))
+
+
+def update_cm_account(login, **values):
+    """
+    Changes CmAccount row and drops its cached copy.
+    :param values: new values of columns, like userplan=100
+    :return CmAccountSnapshot: updated account
+    """
+    account = CmAccount.query.get(login)
+    if account is None:
+        raise ClmOperationalError('CmAccount {} not found'.format(login))
+    for name, value in values.items():
+        setattr(account, name, value)
+    session.commit()
+    invalidate_accounts(login)
+    return get_cm_account(login)
+
+
+def invalidate_accounts(login=None):
+    """
+    Drops cached accounts with given login or all accounts. Call it after changing accounts directly.
+    """
+    _accounts_cache.clear(None if login is None else lambda key: key[1] == login)
 
 
 # TODO: perhaps, move to separate file if reused
@@ -44,18 +111,73 @@ def build_query(params):
     return '&'.join(build_query_item(params))
 
 
+# Requests, that are safe to repeat, and statuses of temporary errors of ClickMeeting
+_idempotent_methods = frozenset(('GET', 'PUT', 'DELETE'))
+_retry_statuses = frozenset((502, 503, 504))
+
+
+def get_http_session():
+    """
+    Returns requests.Session of the current process. Connections to ClickMeeting are kept alive in its pool
+     and reused by all threads. Retries are made by `send_request`, so that each attempt passes the rate limiter.
+    Connections can not be shared with forked processes, so each process creates its own session.
+    """
+    pid = os.getpid()
+    http_session = _http_sessions.get(pid)
+    if http_session is None:
+        with _http_sessions_lock:
+            http_session = _http_sessions.get(pid)
+            if http_session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=app.config['CLM_POOL_SIZE'], max_retries=0)
+                http_session = requests.Session()
+                http_session.mount('https://', adapter)
+                http_session.mount('http://', adapter)
+                # Sessions of the parent process are not used after fork
+                _http_sessions.clear()
+                _http_sessions[pid] = http_session
+    return http_session
+
+
 def send_request(cm_login, method, path, params=None):
-    response = requests.request(method=method.upper(),
-                                url='{0}{1}.json'.format(cm_url, path),
-                                headers={
-                                    'X-Api-Key': clm_service.get_cm_account(cm_login).api_key,
-                                    'Content-Type': 'application/x-www-form-urlencoded'
-                                },
-                                data=build_query(params),
-                                verify=True
-                                )
+    """
+    Sends request to ClickMeeting API. Idempotent requests (GET, PUT, DELETE) are retried up to CLM_RETRIES times
+     after connection errors, timeouts and 502-504 responses with exponential backoff (see CLM_RETRY_BACKOFF).
+    Each attempt takes a token of the rate limiter, so retries do not exceed the rate of the account.
+    Raises RateLimitExceeded, if an attempt can not be sent within CLM_RATE_QUEUE_TIMEOUT.
+    """
+    method = method.upper()
+    attempts = 1 + (app.config['CLM_RETRIES'] if method in _idempotent_methods else 0)
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(app.config['CLM_RETRY_BACKOFF'] * 2 ** (attempt - 1))
+        waited = rate_limiter.acquire(cm_login, app.config['CLM_RATE_QUEUE_TIMEOUT'])
+        if waited:
+            logger.debug('Request %s %s waited %.3f s for rate limit of %s', method, path, waited, cm_login)
+        try:
+            response = get_http_session().request(method=method,
+                                                  url='{0}{1}.json'.format(app.config['CLM_URL'], path),
+                                                  headers={
+                                                      'X-Api-Key': get_cm_account(cm_login).api_key,
+                                                      'Content-Type': 'application/x-www-form-urlencoded'
+                                                  },
+                                                  data=build_query(params),
+                                                  verify=True,
+                                                  timeout=(app.config['CLM_CONNECT_TIMEOUT'],
+                                                           app.config['CLM_READ_TIMEOUT'])
+                                                  )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt < attempts - 1:
+                logger.warning('Retrying %s %s after error: %s', method, path, e)
+                continue
+            raise ClmOperationalError('{} {}: {}'.format(method, path, e))
+        except requests.RequestException as e:
+            raise ClmOperationalError('{} {}: {}'.format(method, path, e))
+        if response.status_code in _retry_statuses and attempt < attempts - 1:
+            logger.warning('Retrying %s %s after response %s', method, path, response.status_code)
+            continue
+        break
     if not response.ok:
-        raise ClmOperationalError(response.content)
+        raise ClmOperationalError(response.content, status_code=response.status_code)
 
     return response.json()
 
@@ -79,18 +201,18 @@ def generate_and_get_tokens(room_id, cm_account_login, how_many):
 
     except ClmOperationalError as e:
         # If response is 403: FORBIDDEN, probably some tokens were already generated
+        if e.status_code != 403:
+            raise
         try:
-            response = json.loads(e.args[0])
-            message = response['errors'][0]['message'].strip().split(' ')
-            generated, allowed = int(message[8]), int(message[17])
-        except:
-            raise ClmOperationalError(e.args[0])
+            generated, allowed = parse_token_limit(e.args[0])
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise e
 
         # Update userplan if necessary
         status['new'] = False
-        cm_account = clm_service.get_cm_account(cm_account_login)
+        cm_account = get_cm_account(cm_account_login)
         if cm_account.userplan * 4 != allowed:
-            clm_service.update_cm_account(cm_account_login, userplan=allowed // 4)
+            update_cm_account(cm_account_login, userplan=allowed // 4)
             logger.info('Updated userplan for {} to {} viewers'.format(cm_account_login, allowed // 4))
 
         # Generate as many tokens as possible
@@ -108,8 +230,64 @@ def generate_and_get_tokens(room_id, cm_account_login, how_many):
             return status, [token_item['token'] for token_item in response['access_tokens']]
 
 
+# Сообщение ClickMeeting об ограничении комнаты состоит из 18 слов: количество сгенерированных токенов - 9-е слово,
+#  допустимое количество - последнее, например "Unable to generate more tokens for this conference, 95 tokens are
+#  generated, 10 requested and limit is 100"
+_token_limit_message = re.compile(r'(?:\S+\s+){8}(\d+)\s+(?:\S+\s+){8}(\d+)')
+
+
+def parse_token_limit(content):
+    """
+    Extracts numbers of generated and allowed tokens from the body of 403 response to the tokens request.
+    Raises ValueError (or KeyError, IndexError, TypeError) if content is not such a response.
+    :param content: body of the response
+    :return: pair (generated, allowed)
+    """
+    message = json.loads(content)['errors'][0]['message']
+    match = _token_limit_message.fullmatch(message.strip())
+    if match is None:
+        raise ValueError('Unexpected message: {}'.format(message))
+    return int(match.group(1)), int(match.group(2))
+
+
+def generate_tokens(room_id, cm_account_login, how_many):
+    """
+    Generates new tokens for the room.
+    Raises TokenLimitError with numbers of generated and allowed tokens, if the limit of the room is reached.
+    :return list: new tokens
+    """
+    try:
+        response = send_request(cm_account_login, 'POST', '/conferences/{0}/tokens'.format(room_id),
+                                {'how_many': how_many})
+    except ClmOperationalError as e:
+        if e.status_code != 403:
+            raise
+        try:
+            generated, allowed = parse_token_limit(e.args[0])
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise e
+        raise TokenLimitError(e.args[0], generated, allowed, status_code=e.status_code)
+    return [token_item['token'] for token_item in response['access_tokens']]
+
+
+def get_tokens(room_id, cm_account_login):
+    """
+    :return list: all tokens generated for the room
+    """
+    response = send_request(cm_account_login, 'GET', '/conferences/{0}/tokens'.format(room_id))
+    return [token_item['token'] for token_item in response['access_tokens']]
+
+
 def get_autologin_hash(lect_user, webinar, token):
-    params = {
+    return request_autologin_hash(webinar.cm_account_login, webinar.room_id, autologin_params(lect_user, token))
+
+
+def autologin_params(lect_user, token):
+    """
+    Parameters of autologin_hash request. Built separately, so that the request itself does not need ORM objects
+     and may be sent from another thread (see clm_async).
+    """
+    return {
         'email': lect_user.email if lect_user.email else 'User' + str(lect_user.lect_id) + '@lectarium.ru',
         'nickname': lect_user.profile.first_name if lect_user.profile.first_name else 'Студент ' + str(
             lect_user.lect_id),
@@ -117,8 +295,9 @@ def get_autologin_hash(lect_user, webinar, token):
         'token': token
     }
 
-    response = send_request(webinar.cm_account_login, 'POST',
-                            '/conferences/' + str(webinar.room_id) + '/room/autologin_hash', params)
+
+def request_autologin_hash(cm_account_login, room_id, params):
+    response = send_request(cm_account_login, 'POST', '/conferences/' + str(room_id) + '/room/autologin_hash', params)
     return response['autologin_hash']
 
 
@@ -10,5 +10,35 @@ class StatusChangeError(CustomException):
 
 class ClmOperationalError(CustomException):
     """
-    Выбрасывается при ошибках во время обращения к ClickMeeting API
+    Выбрасывается при ошибках во время обращения к ClickMeeting API.
+    Атрибут status_code - код ответа ClickMeeting, None для ошибок соединения и других ошибок без ответа
+    """
+    def __init__(self, *args, status_code=None):
+        super().__init__(*args)
+        self.status_code = status_code
+
+
+class ParserError(CustomException):
+    """
+    Выбрасывается при ошибках разбора строки фильтров
+    """
+
+
+class SecurityError(CustomException):
+    """
+    Выбрасывается при попытке фильтрации по секретным полям
+    """
+
+
+class RateLimitExceeded(CustomException):
+    """
+    Выбрасывается, если запрос не может быть выполнен в пределах ограничения частоты до истечения времени ожидания.
+    Аргументы: ключ ограничения и время ожидания в секундах, которое потребовалось бы
+    """
+
+
+class TokenLimitError(ClmOperationalError):
+    """
+    Выбрасывается, если ClickMeeting отказал в генерации токенов из-за ограничения комнаты.
+    Аргументы: текст ответа, количество уже сгенерированных токенов и допустимое количество
     """
@@ -1,3 +1,4 @@
+import math
 import traceback
 import functools
 from datetime import datetime
@@ -21,12 +22,47 @@ def web_error_handler(e):
     return {'message': "Error in clickmeeting API: {}".format(e.args[0])}, 400
 
 
+@api.errorhandler(RateLimitExceeded)
+def rate_limit_error_handler(e):
+    return {'message': "Too many requests to ClickMeeting, try again later"}, 503, \
+           {'Retry-After': str(int(math.ceil(e.args[1])))}
+
+
+@api.errorhandler(ParserError)
+def parser_error_handler(e):
+    return {'message': "Invalid request: {}".format(e.args[0] if e.args else '')}, 400
+
+
+@api.errorhandler(SecurityError)
+def security_error_handler(e):
+    return {'message': "Filtering by secret fields is forbidden"}, 403
+
+
 pagination_parser = api.parser()
 pagination_parser.add_argument('page', type=inputs.positive, help='Page number', default=1)
 pagination_parser.add_argument('size', type=inputs.natural, help='Items per page or 0 for all items', default=0)
 pagination_parser.add_argument('offset', type=inputs.natural, help='Skip first N items', default=0)
 pagination_parser.add_argument('filter', help='Comma-separated filters: field1 EQ "value1", field2 GE "value2"')
 pagination_parser.add_argument('order_by', help='Comma-separated ORDER BY criterions: "field1, -field2"')
+pagination_parser.add_argument('cursor', help='Keyset pagination: value of X-Next-Cursor header of the previous page '
+                                              'or empty string for the first page. Page and offset are ignored')
+pagination_parser.add_argument('count', choices=('exact', 'estimated'),
+                               help='Add X-Total-Count header. Estimated count uses table statistics '
+                                    'and is exact if filter is provided')
+pagination_parser.add_argument('fields', help='Comma-separated names of fields to return: "webinar_id, name". '
+                                               'Defaults to all fields')
+pagination_parser.add_argument('stream', type=inputs.boolean, default=False,
+                               help='With size=0: send all items as chunked JSON array. Offset is ignored')
 
 filter_parser = api.parser()
 filter_parser.add_argument('filter', help='Comma-separated filters: field1 EQ "value1", field2 GE "value2"')
+
+batch_parser = api.parser()
+batch_parser.add_argument('ids', type=inputs.positive, action='split', required=True,
+                          help='Comma-separated ids: "1,2,3"')
+
+export_parser = api.parser()
+export_parser.add_argument('filter', help='Comma-separated filters: field1 EQ "value1", field2 GE "value2"')
+export_parser.add_argument('order_by', help='Comma-separated ORDER BY criterions: "field1, -field2"')
+export_parser.add_argument('xfields', help='Comma-separated names of columns in the table. Defaults to all columns')
+export_parser.add_argument('format', choices=('csv', 'parquet'), default='csv', help='Format of exported file')
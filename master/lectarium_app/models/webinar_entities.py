@@ -54,6 +54,11 @@ class Webinar(db.Model):
     status = db.Column(db.Enum("CREATED", "PLANNED", "BEGINNING", "IN_PROGRESS", "FINISHED", "UPLOADED", "AVAILABLE"),
                        nullable=False)
     #notification_before_minutes = db.Column(db.Integer, server_default='5')
+    # Увеличивается при каждом изменении вебинара, используется для ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.now, server_default=now(), onupdate=datetime.now)
+    # Время начала создания комнаты в ClickMeeting, см. webinar_service.create_webinar_in_clm
+    room_requested_at = db.Column(db.DateTime)
 
     cm_account = db.relationship('CmAccount')
     wtokens = db.relationship('WebinarToken', back_populates='webinar')
@@ -108,10 +113,40 @@ class WebinarToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     webinar_id = db.Column(db.Integer, db.ForeignKey('webinars_added.webinar_id'), nullable=False)
     lect_id = db.Column(db.Integer, db.ForeignKey('users.lect_id'), nullable=True)
-    token = db.Column(db.String(40), nullable=False)
+    token = db.Column(db.String(40), nullable=False, unique=True)
+    # Вычисляется заранее задачей webinars_autologin_hashes, пока вебинар не начался
+    autologin_hash = db.Column(db.String(255))
+    # Время последней неудачной попытки получить autologin hash: задача не запрашивает его повторно
+    #  в течение AUTOLOGIN_HASH_RETRY_INTERVAL
+    hash_failed_at = db.Column(db.DateTime)
 
     user = db.relationship('User')
     webinar = db.relationship('Webinar', back_populates='wtokens')
 
     def __repr__(self):
         return '<WebinarToken for #{0.lect_id} at #{0.webinar_id}>'.format(self)
+
+
+class WebinarTokenPool(db.Model):
+    """
+    Состояние пула токенов вебинара. Пул пополняется в фоне, когда свободных токенов меньше нижней границы
+    """
+    __tablename__ = 'webinars_token_pools'
+
+    webinar_id = db.Column(db.Integer, db.ForeignKey('webinars_added.webinar_id'), primary_key=True)
+    # Количество токенов вебинара в webinars_tokens и количество токенов, выданных пользователям.
+    #  Пересчитываются при пополнении пула и задачей webinars_token_pools
+    size = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    claimed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Сколько токенов ClickMeeting позволяет сгенерировать для комнаты, None - неизвестно
+    allowed = db.Column(db.Integer)
+    refilled_at = db.Column(db.DateTime)
+
+    webinar = db.relationship('Webinar', backref=db.backref('token_pool', uselist=False))
+
+    @property
+    def free(self):
+        return self.size - self.claimed
+
+    def __repr__(self):
+        return '<WebinarTokenPool #{0.webinar_id}: {0.claimed}/{0.size} of {0.allowed}>'.format(self)
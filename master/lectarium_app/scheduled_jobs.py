@@ -9,7 +9,7 @@ from sqlalchemy.exc import StatementError
 from sqlalchemy.orm.exc import NoResultFound
 
 from lectarium_app import webinar_service
-from lectarium_app import scheduler, logger, session
+from lectarium_app import app, scheduler, logger, session
 from lectarium_app.models import Webinar
 
 
@@ -24,8 +24,9 @@ def webinar_status_change():
     for webinar in webinars_with_status_created:
         try:
             if datetime.now() - webinar.created_at > timedelta(minutes=5):
-                webinar_service.create_webinar_in_clm(webinar.webinar_id)
-                webinar_service.update_web_status(webinar.webinar_id, "PLANNED")
+                # Комнату может создавать другой процесс (см. create_webinars_in_clm), он же переводит вебинар в PLANNED
+                if webinar_service.create_webinar_in_clm(webinar.webinar_id).room_id is not None:
+                    webinar_service.update_web_status(webinar.webinar_id, "PLANNED")
         except Exception as ex:
             logger.error('Error while creating webinar: %s', ex)
 
@@ -41,3 +42,42 @@ def webinar_status_change():
     for webinar in webinars_with_status_in_progress:
         if webinar_service.is_webinar_finished_in_clm(webinar.webinar_id):
             webinar_service.update_web_status(webinar.webinar_id, "FINISHED")
+
+
+@scheduler.task('interval', id='webinars_autologin_hashes', minutes=1, max_instances=1)
+def webinar_autologin_hashes():
+    """
+    Заранее получает autologin hash для пользователей с токенами, чтобы при начале вебинара вход не ждал ClickMeeting
+    """
+    with scheduler.app.app_context():
+        batch_size = app.config['AUTOLOGIN_HASH_BATCH_SIZE']
+        while True:
+            try:
+                saved, failed = webinar_service.precompute_autologin_hashes(batch_size)
+            except Exception as ex:
+                logger.error('Error while precomputing autologin hashes: %s', ex)
+                session.rollback()
+                break
+            if saved:
+                logger.info('Precomputed %s autologin hashes', saved)
+            # Неполный пакет означает, что все hash уже запрошены. Если не удался ни один запрос, ClickMeeting,
+            #  вероятно, недоступен: остальные токены обрабатываются при следующем запуске
+            if saved + failed < batch_size or not saved:
+                break
+
+
+@scheduler.task('interval', id='webinars_token_pools', minutes=1, max_instances=1)
+def webinar_token_pools():
+    """
+    Пополняет пулы токенов вебинаров, чтобы выдача токена пользователю никогда не ждала ClickMeeting
+    """
+    with scheduler.app.app_context():
+        try:
+            webinar_service.sync_token_pools()
+            refilled = webinar_service.refill_token_pools()
+        except Exception as ex:
+            logger.error('Error while refilling token pools: %s', ex)
+            session.rollback()
+        else:
+            if refilled:
+                logger.info('Refilled %s token pools', refilled)
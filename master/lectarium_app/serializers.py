@@ -49,3 +49,28 @@ webinar_full_model = api.model('webinar (full)', {
     'status': fields.String(read_only=True, enum=("CREATED", "PLANNED", "BEGINNING",
                                                   "IN_PROGRESS", "FINISHED", "UPLOADED", "AVAILABLE")),
 })
+
+webinar_bulk_patch_model = api.inherit('webinar patch (bulk)', webinar_full_model, {
+    'webinar_id': fields.Integer(required=True),
+})
+
+webinar_batch_model = api.model('webinar batch', {
+    'items': fields.List(fields.Nested(webinar_full_model)),
+    'missing': fields.List(fields.Integer),
+})
+
+webinar_token_model = api.model('webinar token', {
+    'webinar_id': fields.Integer(read_only=True),
+    'token': fields.String(read_only=True),
+    'autologin_hash': fields.String(read_only=True),
+})
+
+webinar_tokens_reserve_model = api.model('webinar tokens reservation', {
+    'lect_ids': fields.List(fields.Integer, required=True),
+})
+
+export_job_model = api.model('export job', {
+    'job_id': fields.String(read_only=True),
+    'status': fields.String(read_only=True, enum=('RUNNING', 'DONE', 'FAILED')),
+    'error': fields.String(read_only=True),
+})
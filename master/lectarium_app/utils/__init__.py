@@ -3,5 +3,11 @@
 Модули в этом пакете могут импортировать содержимое lectarium_app, включая модули (например, ath_services),
  но не содержимое подмодулей (например, ath_services.get_user).
 """
+from .cache import *
 from .pagination import *
+from .rate_limit import *
+from .columnar import *
+from .conditional import *
+from .export_jobs import *
+from .response_cache import *
 from .update_aggregated import *
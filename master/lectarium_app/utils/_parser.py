@@ -62,19 +62,39 @@ class Parser:
         except IndexError:
             raise exceptions.ParserError('LR tables are corrupted')
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._master_pattern, cls._master_groups = cls._compile_token_patterns(cls.token_patterns)
+
+    @staticmethod
+    def _compile_token_patterns(token_patterns):
+        """
+        Joins all token patterns into one regexp: (pattern1)|(pattern2)|...
+        Alternatives are tried in the order of token_patterns, so the result is the same as trying regexps one by one.
+        :return: compiled regexp and dictionary: index of alternative group -> (token type, index of value group).
+        """
+        alternatives = []
+        groups = {}
+        group_index = 1
+        for regexp, type_ in token_patterns.items():
+            alternatives.append('({})'.format(regexp.pattern))
+            groups[group_index] = (type_, group_index + 1)
+            group_index += 1 + regexp.groups
+        return re.compile('|'.join(alternatives)), groups
+
     def tokens_stream(self, line):
-        while line:
-            for regexp in self.token_patterns:
-                match = regexp.match(line)
-                if match:
-                    type_ = self.token_patterns[regexp]
-                    if type_:
-                        yield Token(type_, match.group(1))
-                    line = line[match.end():]
-                    break
-            else:
+        # The line is never sliced: the regexp matches from the current position to keep tokenizing linear.
+        pos, end = 0, len(line)
+        while pos < end:
+            match = self._master_pattern.match(line, pos)
+            if not match:
                 # No one of patterns matched remain part of line.
-                raise exceptions.ParserError('Unknown pattern near {}'.format(line))
+                raise exceptions.ParserError('Unknown pattern near {}'.format(line[pos:]))
+            # lastindex is the outer group of the alternative, since it is closed after the value group.
+            type_, value_group = self._master_groups[match.lastindex]
+            if type_:
+                yield Token(type_, match.group(value_group))
+            pos = match.end()
         yield Token('$end', None)
 
     def _parse(self, tokens_iter):
@@ -103,6 +123,14 @@ class Parser:
         return self.stack[0].value
 
 
+def _append_const(values, separator, const):
+    # The list is created by the rule "const_list -> CONST" for each IN clause, so it can be safely modified.
+    if separator != ',':
+        raise exceptions.ParserError('Values of IN must be separated by comma, got "{}"'.format(separator))
+    values.append(const)
+    return values
+
+
 class FilterParser(Parser):
     # Do not use this dictionary to compare python values.
     # Some of its values may create sqlalchemy filters even for two scalars, like int.
@@ -112,7 +140,12 @@ class FilterParser(Parser):
         'GE': operator.ge, '>=': operator.ge,
         'LT': operator.lt, '<': operator.lt,
         'LE': operator.le, '<=': operator.le,
-        'NE': operator.ne, '!=': operator.ne}
+        'NE': operator.ne, '!=': operator.ne,
+        # LIKE 'prefix%' with escaped wildcards, so the index on the column can be used
+        'STARTSWITH': lambda column, prefix: column.startswith(prefix, autoescape=True),
+        # Operators below take a tuple of constants instead of one constant
+        'IN': lambda column, values: column.in_(values),
+        'BETWEEN': lambda column, bounds: column.between(*bounds)}
 
     class NodeAnd(SyntaxNode):
         def __init__(self, left, _and_token, right):
@@ -125,17 +158,33 @@ class FilterParser(Parser):
     class NodeSimpleFilter(SyntaxNode):
         pass
 
+    class NodeInFilter(NodeSimpleFilter):
+        def __init__(self, field, op, _lb, values, _rb):
+            super().__init__(field, op, tuple(values))
+
+    class NodeBetweenFilter(NodeSimpleFilter):
+        def __init__(self, field, op, low, and_token, high):
+            # Comma is tokenized as AND too, but only the word is allowed between bounds
+            if and_token != 'AND':
+                raise exceptions.ParserError('Bounds of BETWEEN must be separated by AND, got "{}"'.format(and_token))
+            super().__init__(field, op, (low, high))
+
     class NodeAggregationFilter(SyntaxNode):
         def __init__(self, aggr, _lb, relation, _sc, expr, _rb, op, const):
             super().__init__(aggr, relation, expr, op, const)
 
+    class NodeFieldAggregationFilter(NodeAggregationFilter):
+        # Aggregation of a field of related entity, like SUM(relation; field; expr). Field is the last argument.
+        def __init__(self, aggr, _lb, relation, _sc1, field, _sc2, expr, _rb, op, const):
+            SyntaxNode.__init__(self, aggr, relation, expr, op, const, field)
+
     lr_actions = {
         0: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
         3: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
         5: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
         6: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
         9: {'FIELD': 14},
-        15: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
+        15: {'FIELD': 31, 'LBRACKET': 3, 'AGGREGATE': 4},
         4: {'LBRACKET': 9},
         1: {'$end': 0, 'AND': 5, 'OR': 6},
         10: {'$end': -4, 'AND': -4, 'OR': -4, 'RBRACKET': -4},
@@ -145,18 +194,41 @@ class FilterParser(Parser):
         19: {'$end': -3, 'AND': -3, 'OR': -3, 'RBRACKET': -3},
         8: {'AND': 5, 'OR': 6, 'RBRACKET': 13},
         16: {'AND': 5, 'OR': 6, 'RBRACKET': 17},
-        2: {'OPERATOR': 7},
+        2: {'OPERATOR': 7, 'IN': 20, 'BETWEEN': 21},
         17: {'OPERATOR': 18},
         7: {'CONST': 12},
         18: {'CONST': 19},
-        14: {';': 15}
+        14: {';': 15},
+        # FIELD IN ( const_list )
+        20: {'LBRACKET': 22},
+        22: {'CONST': 24},
+        24: {'AND': -8, 'RBRACKET': -8},
+        25: {'AND': 28, 'RBRACKET': 27},
+        28: {'CONST': 30},
+        30: {'AND': -9, 'RBRACKET': -9},
+        27: {'$end': -6, 'AND': -6, 'OR': -6, 'RBRACKET': -6},
+        # FIELD BETWEEN CONST AND CONST
+        21: {'CONST': 23},
+        23: {'AND': 26},
+        26: {'CONST': 29},
+        29: {'$end': -7, 'AND': -7, 'OR': -7, 'RBRACKET': -7},
+        # AGGREGATE ( FIELD ; FIELD ; expression ) OPERATOR CONST
+        # State 31 is state 2 with additional item "AGGREGATE ( FIELD ; FIELD . ; expression ) OPERATOR CONST"
+        31: {'OPERATOR': 7, 'IN': 20, 'BETWEEN': 21, ';': 32},
+        32: {'FIELD': 2, 'LBRACKET': 3, 'AGGREGATE': 4},
+        33: {'AND': 5, 'OR': 6, 'RBRACKET': 34},
+        34: {'OPERATOR': 35},
+        35: {'CONST': 36},
+        36: {'$end': -10, 'AND': -10, 'OR': -10, 'RBRACKET': -10},
     }
     lr_goto = {
         0: {'expression': 1},
         3: {'expression': 8},
         5: {'expression': 10},
         6: {'expression': 11},
-        15: {'expression': 16}
+        15: {'expression': 16},
+        22: {'const_list': 25},
+        32: {'expression': 33},
     }
     # Note: this object should be sorted since two letter operators (>=) should not be parsed as (>) + (=),
     #  while regexp (=|>|>=) does exactly this error, and *unordered* dict {'>=': 'OP', '>': 'OP'} may do it too.
@@ -167,7 +239,11 @@ class FilterParser(Parser):
         re.compile(r'(==|>=|<=|!=)'): 'OPERATOR',
         re.compile(r'([<=>])'): 'OPERATOR',
         # Match only whole word. It is one of ways to avoid problem with (le)ct_id
-        re.compile(r'\b(EQ|GT|GE|LT|LE|NE)\b'): 'OPERATOR',  # option: re.IGNORECASE
+        # There is no leading \b: a token always starts at the current position of the tokenizer, which was
+        #  the beginning of the line for this regexp when the remain part of line was sliced.
+        re.compile(r'(EQ|GT|GE|LT|LE|NE|STARTSWITH)\b'): 'OPERATOR',  # option: re.IGNORECASE
+        re.compile(r'(IN)\b'): 'IN',
+        re.compile(r'(BETWEEN)\b'): 'BETWEEN',
         re.compile(r'(ANY|ALL|HAS|SUM|COUNT)'): 'AGGREGATE',
         re.compile(r'(\()'): 'LBRACKET',
         re.compile(r'(\))'): 'RBRACKET',
@@ -186,10 +262,16 @@ class FilterParser(Parser):
         Rule('expression', 8, NodeAggregationFilter),
         Rule('expression', 3, NodeAnd),
         Rule('expression', 3, NodeOr),
+        Rule('expression', 5, NodeInFilter),
+        Rule('expression', 5, NodeBetweenFilter),
+        Rule('const_list', 1, lambda const: [const]),
+        Rule('const_list', 3, _append_const),
+        Rule('expression', 10, NodeFieldAggregationFilter),
     ]
 
 
 assert all(
-    any(regexp.match(op) for (regexp, value) in FilterParser.token_patterns.items() if value == 'OPERATOR')
+    any(regexp.match(op) for (regexp, value) in FilterParser.token_patterns.items()
+        if value in ('OPERATOR', 'IN', 'BETWEEN'))
     for op in FilterParser.mapping_operators
 ), "Not all operators can be parsed by regular expressions!"
@@ -0,0 +1,91 @@
+__all__ = ['LRUCache']
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping. When the cache is full, the least recently used item is evicted.
+    Items may also expire after ttl seconds. Counts hits, misses and evictions, see `stats` method.
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        """
+        :param int maxsize: maximal number of stored items. Non-positive value disables caching at all.
+        :param float ttl: lifetime of items in seconds. None means that items never expire.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """
+        Returns cached value for the key or calls factory() and caches its result.
+        Factory is called without holding the lock, so two threads may compute the same value simultaneously.
+        Exceptions raised by factory are not cached.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, (default, None))[0]
+
+    def clear(self, predicate=None):
+        """
+        Removes all items or only items which keys satisfy the predicate.
+        :param predicate: function: key -> bool
+        """
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def stats(self):
+        """
+        :return dict: current size, maxsize and hit/miss/eviction counters.
+        """
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
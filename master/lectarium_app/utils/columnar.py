@@ -0,0 +1,166 @@
+__all__ = ['ColumnarMixin']
+import io
+
+from flask import Response, stream_with_context
+
+from lectarium_app import app, db
+from .pagination import PaginationMixin, is_secured
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Columnar exports are optional: the rest of the application works without pyarrow
+    pyarrow = None
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object which keeps written bytes until they are taken by `pop` method.
+    """
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ColumnarMixin(PaginationMixin):
+    """
+    Exports BaseEntity table as Arrow IPC stream or Parquet file. Unlike CsvMixin, values keep their types
+     (timestamps, durations, enums). Rows are read by batches of columns (see `iterate_batches`) without creating
+     ORM objects and each batch is converted to one Arrow record batch.
+    """
+    def columnar_fields(self, xfields=None):
+        """
+        :param xfields: list with names of BaseEntity columns should be in the table. Defaults to all columns,
+                        except secret ones (see is_secured), which can not be requested at all.
+        :return list: names of columns in the order of xfields
+        """
+        columns = self.BaseEntity.__table__.columns
+        if xfields:
+            for name in xfields:
+                self._get_field(name)  # Raises an exception for unknown or secret fields
+            return [name for name in xfields if name in columns]
+        return [column.name for column in columns if not is_secured(column.name)]
+
+    def arrow_schema(self, names):
+        self._check_pyarrow()
+        columns = self.BaseEntity.__table__.columns
+        return pyarrow.schema([pyarrow.field(name, self._arrow_type(columns[name].type)) for name in names])
+
+    @staticmethod
+    def _arrow_type(column_type):
+        if isinstance(column_type, db.Enum):
+            return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        if isinstance(column_type, db.Interval):
+            return pyarrow.duration('us')
+        if isinstance(column_type, db.DateTime):
+            return pyarrow.timestamp('us')
+        if isinstance(column_type, db.Date):
+            return pyarrow.date32()
+        if isinstance(column_type, db.Boolean):
+            return pyarrow.bool_()
+        if isinstance(column_type, db.Integer):
+            return pyarrow.int64()
+        if isinstance(column_type, (db.Float, db.Numeric)):
+            return pyarrow.float64()
+        return pyarrow.string()
+
+    @staticmethod
+    def _check_pyarrow():
+        if pyarrow is None:
+            raise RuntimeError('Columnar exports require pyarrow')
+
+    def _record_batches(self, args, extra_filters, names, schema, batch_size):
+        # Enum values are encoded with one dictionary of all values of the enum. Writers do not send replacements
+        #  of a dictionary, so all batches of the stream must share it
+        columns = self.BaseEntity.__table__.columns
+        dictionaries = {field.name: columns[field.name].type.enums
+                        for field in schema if pyarrow.types.is_dictionary(field.type)}
+        for rows in self.iterate_batches(args, extra_filters, batch_size, columns=names):
+            # Requested columns go first in the rows, columns of ORDER BY criteria may follow them
+            values = list(zip(*rows))
+            arrays = []
+            for index, field in enumerate(schema):
+                if field.name in dictionaries:
+                    arrays.append(self._dictionary_array(values[index], dictionaries[field.name]))
+                else:
+                    arrays.append(pyarrow.array(values[index], type=field.type))
+            yield pyarrow.RecordBatch.from_arrays(arrays, names)
+
+    @staticmethod
+    def _dictionary_array(values, enums):
+        codes = {value: code for code, value in enumerate(enums)}
+        indices = pyarrow.array([None if value is None else codes[value] for value in values], type=pyarrow.int32())
+        return pyarrow.DictionaryArray.from_arrays(indices, pyarrow.array(enums, type=pyarrow.string()))
+
+    def stream_arrow(self, args, extra_filters=(), xfields=None, batch_size=None):
+        """
+        Return generator of chunks of Arrow IPC stream: the schema and then one record batch for each batch of rows.
+        Pass the result to `make_arrow_response`.
+        :param args: see PaginationMixin::iterate_batches. Page, size and offset are ignored.
+        :param extra_filters: see PaginationMixin::paginate
+        :param xfields: see `columnar_fields` method
+        :param batch_size: number of rows in one record batch. Defaults to COLUMNAR_BATCH_SIZE.
+        """
+        self._check_pyarrow()
+        # Errors in the filter and xfields are raised here, before the response is started
+        self.parse_filters(args['filter'])
+        names = self.columnar_fields(xfields)
+        schema = self.arrow_schema(names)
+        return self._generate_arrow(args, extra_filters, names, schema, batch_size)
+
+    def _generate_arrow(self, args, extra_filters, names, schema, batch_size):
+        sink = _ChunkSink()
+        writer = pyarrow.RecordBatchStreamWriter(sink, schema)
+        yield sink.pop()
+        for batch in self._record_batches(args, extra_filters, names, schema, self._batch_size(batch_size)):
+            writer.write_batch(batch)
+            yield sink.pop()
+        writer.close()
+        yield sink.pop()
+
+    def write_parquet(self, args, file, extra_filters=(), xfields=None, batch_size=None):
+        """
+        Writes Parquet file with one row group for each batch of rows.
+        :param file: path or binary file-like object
+        Other parameters are the same as for `stream_arrow` method.
+        """
+        self._check_pyarrow()
+        self.parse_filters(args['filter'])
+        names = self.columnar_fields(xfields)
+        schema = self.arrow_schema(names)
+        writer = pyarrow.parquet.ParquetWriter(file, schema)
+        try:
+            for batch in self._record_batches(args, extra_filters, names, schema, self._batch_size(batch_size)):
+                writer.write_table(pyarrow.Table.from_batches([batch], schema))
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _batch_size(batch_size):
+        return batch_size or app.config['COLUMNAR_BATCH_SIZE']
+
+    @staticmethod
+    def make_arrow_response(chunks, filename=None):
+        """
+        Utility function. Sends chunks of Arrow IPC stream to the client as soon as they are produced.
+        :param chunks: iterable of bytes, for example result of `stream_arrow` method
+        :param str filename: filename that will be shown to client
+        :return: flask http response object
+        """
+        headers = {'Cache-Control': 'no-cache'}
+        if filename:
+            headers['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return Response(stream_with_context(chunks), mimetype='application/vnd.apache.arrow.stream', headers=headers)
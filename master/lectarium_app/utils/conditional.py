@@ -0,0 +1,143 @@
+__all__ = ['ConditionalMixin', 'make_etag', 'is_conditional', 'is_not_modified', 'conditional_headers']
+import hashlib
+import json
+from datetime import datetime
+
+from flask import request
+from flask_restplus import marshal
+from sqlalchemy.inspection import inspect
+from werkzeug.http import http_date, quote_etag
+
+from .pagination import PaginationMixin
+
+
+def make_etag(*parts):
+    """
+    Returns strong entity tag (without quotes) built from JSON-serializable parts.
+    """
+    return hashlib.sha1(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+
+
+def _to_utc(last_modified):
+    # Timestamps in the database are naive local time, HTTP dates are in UTC with one second precision
+    return datetime.utcfromtimestamp(int(last_modified.timestamp()))
+
+
+def is_conditional():
+    """
+    Shows if the current request contains If-None-Match or If-Modified-Since header.
+    """
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def is_not_modified(etag, last_modified=None):
+    """
+    Evaluates conditional headers of the current GET request.
+    If-None-Match takes precedence over If-Modified-Since, as required by RFC 7232.
+    :param str etag: current entity tag of the resource, see `make_etag`
+    :param datetime last_modified: time of the last change of the resource. Pass None if the time does not reflect
+                                   all changes (for example, deletions from a collection).
+    :return bool: True, if response 304 Not Modified should be sent
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return _to_utc(last_modified) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional_headers(etag, last_modified=None):
+    """
+    :return dict: ETag and Last-Modified headers for the response
+    """
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return headers
+
+
+class ConditionalMixin(PaginationMixin):
+    """
+    Conditional GET for collections of BaseEntity, that has a version column increased on each change.
+    ETag of a page is built from primary keys and versions of its objects, so it changes when any object of the page
+     is changed, added or deleted. Check is done by a query of these columns only, so unchanged page is neither
+     loaded nor serialized.
+    """
+    version_field = 'version'
+    updated_field = 'updated_at'
+
+    def loader_options(self, fields, required=()):
+        # Versions are needed for ETag even if the client has not requested them
+        return super().loader_options(fields, list(required) + [self.version_field, self.updated_field])
+
+    def _page_validators(self, args, rows, total=None):
+        """
+        :param rows: objects or rows of the page with primary key, version and updated_at
+        :param total: value of X-Total-Count header, if it is sent
+        :return: pair (etag, last_modified)
+        """
+        pk = [column.key for column in inspect(self.BaseEntity).primary_key]
+        keys = [[getattr(row, name) for name in pk] + [getattr(row, self.version_field)] for row in rows]
+        representation = {name: args.get(name) for name in ('filter', 'order_by', 'fields', 'page', 'size',
+                                                                'offset', 'cursor')}
+        updated = [getattr(row, self.updated_field) for row in rows if getattr(row, self.updated_field) is not None]
+        return make_etag(self.BaseEntity.__tablename__, representation, keys, total), max(updated, default=None)
+
+    def collection_validators(self, args, extra_filters=()):
+        """
+        Computes ETag and Last-Modified of the page selected by `paginate_with_headers` with the same arguments
+         using only primary key and version columns.
+        :return: pair (etag, last_modified)
+        """
+        columns = [column.key for column in inspect(self.BaseEntity).primary_key]
+        columns += [self.version_field, self.updated_field]
+        if args.get('cursor') is not None:
+            rows, _ = self.paginate_keyset(args, extra_filters, columns=columns)
+        else:
+            rows = self.paginate(args, extra_filters, columns=columns)
+        total = None
+        if args.get('count'):
+            total = str(self.total_count(args['filter'], extra_filters, estimated=(args['count'] == 'estimated')))
+        return self._page_validators(args, rows, total)
+
+    def paginate_conditional(self, args, extra_filters=()):
+        """
+        Conditional version of `paginate_with_headers`. Validators are checked by a cheap query before the page
+         is loaded, if the client has sent conditional headers.
+        :return: triple (list of BaseEntity objects or None, dictionary with http headers, status code 200 or 304)
+        """
+        if is_conditional():
+            etag, last_modified = self.collection_validators(args, extra_filters)
+            # Last-Modified of a page does not change when an object is deleted, so only ETag is checked
+            if is_not_modified(etag):
+                return None, conditional_headers(etag, last_modified), 304
+        entities, headers = self.paginate_with_headers(args, extra_filters)
+        etag, last_modified = self._page_validators(args, entities, headers.get('X-Total-Count'))
+        headers.update(conditional_headers(etag, last_modified))
+        return entities, headers, 200
+
+    def cached_page(self, cache, args, model, extra_filters=(), key_extra=()):
+        """
+        Conditional page marshalled with the model and stored in the ResponseCache.
+        Cached page is served (or answered with 304 by its ETag) without database queries.
+        :param ResponseCache cache: cache, which is invalidated on every change of BaseEntity objects
+        :param args: see `paginate_with_headers` method
+        :param model: flask_restplus model or dictionary of fields, see `select_fields` method
+        :param extra_filters: see `paginate` method. Values they depend on must be passed in key_extra.
+        :param key_extra: other values, that distinguish responses with the same args (route, user id etc)
+        :return: triple (payload or None, status code, headers) that can be returned from a resource
+        """
+        # The key is built before the database is read, see ResponseCache
+        key = cache.make_key(args, *key_extra)
+        cached = cache.get(key)
+        if cached is not None:
+            payload, headers = cached
+            if is_not_modified(headers['ETag'].strip('"')):
+                return None, 304, {name: headers[name] for name in ('ETag', 'Last-Modified') if name in headers}
+            return payload, 200, headers
+        entities, headers, code = self.paginate_conditional(args, extra_filters)
+        if code == 304:
+            return None, code, headers
+        payload = marshal(entities, model)
+        cache.put(key, payload, headers)
+        return payload, 200, headers
@@ -0,0 +1,151 @@
+__all__ = ['ExportJobs']
+import hashlib
+import json
+import os
+import re
+import time
+
+from lectarium_app import app, executor, logger
+
+
+class ExportJobs:
+    """
+    Background exports of CsvMixin (csv) or ColumnarMixin (parquet) tables.
+    Files are written to the spool directory by Flask-Executor workers.
+    Job id consists of the format and a hash of export parameters, so identical requests made within ttl share
+     one file. The state of a job is stored in the spool directory, so it is visible to all processes:
+        <job_id>.part     - export is in progress
+        <job_id>.<format> - export is finished
+        <job_id>.error    - export failed, the file contains an error message
+    """
+    DONE = 'DONE'
+    RUNNING = 'RUNNING'
+    FAILED = 'FAILED'
+    # Format -> mimetype of the exported file
+    FORMATS = {'csv': 'text/csv', 'parquet': 'application/octet-stream'}
+
+    def __init__(self, spool_dir=None, ttl=None):
+        """
+        :param str spool_dir: directory for exported files. Defaults to EXPORT_SPOOL_DIR.
+        :param float ttl: lifetime of exported files in seconds. Defaults to EXPORT_TTL.
+        """
+        self.spool_dir = spool_dir or app.config['EXPORT_SPOOL_DIR']
+        self.ttl = ttl if ttl is not None else app.config['EXPORT_TTL']
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    @staticmethod
+    def job_id(entity_cls, args, xfields=None, format_='csv'):
+        key = [entity_cls.__module__ + '.' + entity_cls.__qualname__,
+               args.get('filter') or '', args.get('order_by') or '', list(xfields or [])]
+        return '{}-{}'.format(format_, hashlib.sha1(json.dumps(key).encode()).hexdigest())
+
+    def is_valid_id(self, job_id):
+        match = re.fullmatch(r'([a-z]+)-[0-9a-f]{40}', job_id)
+        return match is not None and match.group(1) in self.FORMATS
+
+    @staticmethod
+    def format_of(job_id):
+        return job_id.split('-', 1)[0]
+
+    def mimetype(self, job_id):
+        return self.FORMATS[self.format_of(job_id)]
+
+    def path(self, job_id, suffix=None):
+        # job_id comes from url, so it is checked before it becomes a part of the path
+        if not self.is_valid_id(job_id):
+            raise ValueError('Invalid export job id {}'.format(job_id))
+        return os.path.join(self.spool_dir, job_id + (suffix or '.' + self.format_of(job_id)))
+
+    def _is_fresh(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl
+        except FileNotFoundError:
+            return False
+
+    def status(self, job_id):
+        """
+        :return: one of DONE, RUNNING, FAILED or None if there is no such job (or it is expired).
+        """
+        if not self.is_valid_id(job_id):
+            return None
+        if self._is_fresh(self.path(job_id)):
+            return self.DONE
+        # A running export writes its file after each batch, so an old .part file belongs to a dead worker
+        if self._is_fresh(self.path(job_id, '.part')):
+            return self.RUNNING
+        if self._is_fresh(self.path(job_id, '.error')):
+            return self.FAILED
+        return None
+
+    def error(self, job_id):
+        try:
+            with open(self.path(job_id, '.error')) as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def submit(self, exporter, args, xfields=None, headers=None, additional_properties=None, format_='csv'):
+        """
+        Starts background export, unless the same export is finished or running.
+        Access restrictions (extra_filters) are not supported: results are shared between all clients.
+        :param exporter: CsvMixin for csv or ColumnarMixin for parquet with BaseEntity set. Used in a worker thread.
+        :param args: dictionary with keys filter and order_by, see PaginationMixin::paginate
+        :param str format_: one of FORMATS
+        Other parameters are passed to the CsvMixin::stream unchanged. Parquet export uses xfields only.
+        :return str: job id
+        """
+        self.cleanup()
+        job_id = self.job_id(exporter.BaseEntity, args, xfields, format_)
+        if self.status(job_id) in (self.DONE, self.RUNNING):
+            return job_id
+
+        # Errors in the filter are reported to the client immediately
+        exporter.parse_filters(args.get('filter'))
+
+        part_path = self.path(job_id, '.part')
+        try:
+            # O_EXCL guarantees that only one process starts the export. A fresh .part file may have been created
+            #  by another process after the status check, so it is never removed here: files of dead workers
+            #  are expired and removed by cleanup above.
+            fd = os.open(part_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return job_id
+        if os.path.exists(self.path(job_id, '.error')):
+            os.remove(self.path(job_id, '.error'))
+        args = {'filter': args.get('filter'), 'order_by': args.get('order_by')}
+        executor.submit(self._run, fd, job_id, exporter, args, xfields, headers, additional_properties)
+        return job_id
+
+    def _run(self, fd, job_id, exporter, args, xfields, headers, additional_properties):
+        part_path = self.path(job_id, '.part')
+        try:
+            if self.format_of(job_id) == 'parquet':
+                with open(fd, 'wb') as file:
+                    exporter.write_parquet(args, file, xfields=xfields)
+            else:
+                with open(fd, 'w', newline='') as file:
+                    for chunk in exporter.stream(args, xfields=xfields, headers=headers,
+                                                 additional_properties=additional_properties):
+                        file.write(chunk)
+                        file.flush()
+            os.replace(part_path, self.path(job_id))
+        except Exception as e:
+            logger.error('Error while exporting %s: %s', job_id, e)
+            with open(self.path(job_id, '.error'), 'w') as file:
+                file.write(str(e))
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        else:
+            logger.info('Export %s completed', job_id)
+
+    def cleanup(self):
+        """
+        Removes expired files from the spool directory.
+        """
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if not self._is_fresh(path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
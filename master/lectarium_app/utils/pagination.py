@@ -1,15 +1,32 @@
-__all__ = ['PaginationMixin', 'CsvMixin', 'is_field', 'is_relationship', 'get_entity_from_relationship']
+__all__ = ['PaginationMixin', 'CsvMixin', 'is_field', 'is_secured', 'is_relationship', 'get_entity_from_relationship']
+import base64
+import binascii
 import csv
+import io
+import itertools
+import json
 import operator
 import os
 import tempfile
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import and_, false, func, or_, select, text
+from sqlalchemy.orm import load_only, selectinload
 from sqlalchemy.sql.elements import True_
 from sqlalchemy.inspection import inspect
-from flask import send_file
+from flask import Response, send_file, stream_with_context
+from flask_restplus import marshal
 from flask_sqlalchemy import Model
 
-from lectarium_app import exceptions
+from lectarium_app import app, exceptions
 from ._parser import FilterParser
+from .cache import LRUCache
+
+# Fields, which names contain one of these strings, can not be used in filters and are never exported:
+#  anyone who knows their values can act on behalf of a user or an account
+SECURED_FIELDS = ('token', 'password', 'secret', 'autologin_hash')
 
 
 def is_field(entity_cls, attr):
@@ -26,6 +43,15 @@ def is_field(entity_cls, attr):
     return attr in mapper.all_orm_descriptors and attr not in mapper.relationships
 
 
+def is_secured(field):
+    """
+    Shows if field is secret (see SECURED_FIELDS)
+    :param str field: field name
+    :return bool:
+    """
+    return any(s in field for s in SECURED_FIELDS)
+
+
 def is_relationship(entity_cls, attr):
     """
     Shows if attribute attr represents relationship to any other entity.
@@ -49,8 +75,50 @@ def get_entity_from_relationship(entity_cls, attr):
     return getattr(entity_cls, attr).mapper.class_
 
 
+def _dump_cursor_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load_cursor_value(value, column):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is timedelta:
+        return timedelta(seconds=value)
+    if python_type is Decimal:
+        return Decimal(value)
+    return value
+
+
+def _keyset_after(column, value, descending):
+    """
+    Condition "column value goes strictly after the given value" for ORDER BY column [DESC].
+    NULL is considered less than any other value, as MySQL and SQLite do.
+    """
+    if not descending:
+        return column.isnot(None) if value is None else column > value
+    return false() if value is None else (column < value) | column.is_(None)
+
+
 class PaginationMixin(FilterParser):
     BaseEntity = None
+    # Syntax trees of recently used filter strings. Shared by all subclasses, the key is (BaseEntity, filters_str).
+    filters_cache = LRUCache(app.config['FILTER_CACHE_SIZE'])
+    # Results of items_count. The key is (BaseEntity, filters_str). See `total_count` and `invalidate_counts`.
+    counts_cache = LRUCache(app.config['COUNT_CACHE_SIZE'], ttl=app.config['COUNT_CACHE_TTL'])
+    # Properties of BaseEntity, that are built from related objects: property name -> relationship name.
+    # When such property is requested, the relationship is loaded for the whole page by one additional query.
+    preloaded_properties = {}
 
     def __init__(self, base_entity_cls=None):
         """
@@ -65,6 +133,18 @@ class PaginationMixin(FilterParser):
         # FIXME: Временное решение для парсинга фильтров ' == "NULL"' и ' != "NULL"'
         return None if const == "NULL" else const
 
+    @staticmethod
+    def _mapping_number(const):
+        # Aggregated values are compared with numbers: not every database casts string constant to a number
+        try:
+            return int(const)
+        except ValueError:
+            pass
+        try:
+            return float(const)
+        except ValueError:
+            raise exceptions.ParserError('"{}" is not a number'.format(const))
+
     def _check_entity_type(self):
         if not issubclass(self.BaseEntity, Model):
             raise ValueError('PaginationMixin requires set BaseEntity')
@@ -81,19 +161,27 @@ class PaginationMixin(FilterParser):
         else:
             raise TypeError('Syntax tree must be instance of subclass of SyntaxNode, got {}'.format(syntax_tree))
 
-    def _construct_simple_filter(self, field, op, const):
+    def _get_field(self, field):
         if not is_field(self.BaseEntity, field):
             raise exceptions.ParserError('"{}" is not a field of {}'.format(field, self.BaseEntity))
-        secured = ('token', 'password', 'secret')
-        if any(s in field for s in secured):
+        if is_secured(field):
             raise exceptions.SecurityError
-        return self.mapping_operators[op](getattr(self.BaseEntity, field), self._mapping_const(const))
+        return getattr(self.BaseEntity, field)
 
-    def _construct_aggregation_filter(self, aggr, relation, expr, op, const):
+    def _construct_simple_filter(self, field, op, const):
+        return self.mapping_operators[op](self._get_field(field), self._mapping_const(const))
+
+    def _construct_aggregation_filter(self, aggr, relation, expr, op, const, field=None):
         related_entity = get_entity_from_relationship(self.BaseEntity, relation)
-        sub_expr = PaginationMixin(related_entity)._evaluate_tree(expr)
+        related = PaginationMixin(related_entity)
+        sub_expr = related._evaluate_tree(expr)
         op = self.mapping_operators[op]
         relation = getattr(self.BaseEntity, relation)
+        if aggr in ('COUNT', 'SUM'):
+            subquery = self._construct_aggregation_subquery(aggr, relation, related, field, sub_expr)
+            return op(subquery, self._mapping_number(const))
+        if field is not None:
+            raise exceptions.ParserError('{} does not accept a field, use {}(relation; filter)'.format(aggr, aggr))
         # One has to use HAS when related entity is a 'parent' and ANY/ALL when 'child'
         # Otherwise raises sqlalchemy.exc.InvalidRequestError
         if aggr == 'ANY':
@@ -105,6 +193,32 @@ class PaginationMixin(FilterParser):
         else:
             raise NotImplementedError
 
+    @staticmethod
+    def _construct_aggregation_subquery(aggr, relation, related, field, sub_expr):
+        """
+        Builds correlated scalar subquery like
+         (SELECT count(*) FROM related WHERE related.fk = base.pk AND sub_expr)
+        Base entity table is excluded from FROM list by sqlalchemy auto-correlation with the outer query.
+        :param str aggr: COUNT or SUM
+        :param relation: relationship attribute of the base entity
+        :param PaginationMixin related: PaginationMixin for the related entity
+        :param str field: field of the related entity to aggregate. Required for SUM, optional for COUNT.
+        :param sub_expr: filter for related entities
+        :return: scalar subquery
+        """
+        if field is not None:
+            column = related._get_field(field)
+            aggregated = func.count(column) if aggr == 'COUNT' else func.coalesce(func.sum(column), 0)
+        elif aggr == 'COUNT':
+            aggregated = func.count()
+        else:
+            raise exceptions.ParserError('{0} requires a field: {0}(relation; field; filter)'.format(aggr))
+
+        condition = relation.property.primaryjoin
+        if relation.property.secondary is not None:
+            condition = condition & relation.property.secondaryjoin
+        return select([aggregated]).where(condition & sub_expr).as_scalar()
+
     def parse_filters(self, filters_str):
         """
         Преобразовывает строку с условиями, разделенными запятой, в список условий sqlalchemy.
@@ -115,7 +229,8 @@ class PaginationMixin(FilterParser):
         """
         if not filters_str:
             return True_()
-        syntax_tree = self.parse(self.tokens_stream(filters_str))
+        syntax_tree = self.filters_cache.get_or_create((self.BaseEntity, filters_str),
+                                                       lambda: self.parse(self.tokens_stream(filters_str)))
         return self._evaluate_tree(syntax_tree)
 
     def parse_order_clauses(self, sorting_str):
@@ -125,9 +240,15 @@ class PaginationMixin(FilterParser):
         :param sorting_str:
         :return:
         """
+        return self._criteria_to_clauses(self._parse_order_criteria(sorting_str))
+
+    def _parse_order_criteria(self, sorting_str):
+        """
+        :return list: pairs (field name, descending)
+        """
         if not sorting_str:
             return []
-        order_clauses = []
+        criteria = []
         for criterion in sorting_str.split(','):
             criterion = criterion.strip()
             descending = False
@@ -137,11 +258,100 @@ class PaginationMixin(FilterParser):
 
             if not is_field(self.BaseEntity, criterion):
                 continue
-            variable = getattr(self.BaseEntity, criterion)
+            criteria.append((criterion, descending))
+        return criteria
+
+    def _criteria_to_clauses(self, criteria):
+        order_clauses = []
+        for name, descending in criteria:
+            variable = getattr(self.BaseEntity, name)
             order_clauses.append(variable.desc() if descending else variable)
         return order_clauses
 
-    def paginate(self, args, extra_filters=()):
+    def _keyset_criteria(self, sorting_str):
+        """
+        Order criteria from sorting_str followed by primary key, so the order of rows is unambiguous.
+        """
+        criteria = self._parse_order_criteria(sorting_str)
+        names = {name for name, _ in criteria}
+        mapper = inspect(self.BaseEntity)
+        for column in mapper.primary_key:
+            name = mapper.get_property_by_column(column).key
+            if name not in names:
+                criteria.append((name, False))
+        return criteria
+
+    def _keyset_filter(self, criteria, values):
+        """
+        Builds condition "row goes after the row with given values of criteria":
+         (c1 > v1) OR (c1 = v1 AND c2 > v2) OR (c1 = v1 AND c2 = v2 AND c3 > v3) ...
+        """
+        conditions = []
+        equal = []
+        for (name, descending), value in zip(criteria, values):
+            column = getattr(self.BaseEntity, name)
+            conditions.append(and_(*equal, _keyset_after(column, value, descending)))
+            equal.append(column.is_(None) if value is None else column == value)
+        return or_(*conditions)
+
+    @staticmethod
+    def _encode_cursor(sorting_str, values):
+        payload = {'o': sorting_str, 'v': [_dump_cursor_value(value) for value in values]}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+    def _decode_cursor(self, cursor, sorting_str, criteria):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values = payload['v']
+            if payload['o'] != sorting_str or len(values) != len(criteria):
+                raise exceptions.ParserError('Cursor does not match order_by "{}"'.format(sorting_str))
+            return [_load_cursor_value(value, getattr(self.BaseEntity, name))
+                    for value, (name, _) in zip(values, criteria)]
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise exceptions.ParserError('Malformed cursor')
+
+    @staticmethod
+    def parse_fields(fields_str):
+        """
+        Преобразовывает строку с названиями полей, разделенными запятой, в список названий.
+        :param str fields_str:
+        :return list: names of fields or None, if fields_str is empty (that means all fields).
+        """
+        if not fields_str:
+            return None
+        return [field.strip() for field in fields_str.split(',') if field.strip()]
+
+    def loader_options(self, fields, required=()):
+        """
+        Returns query options that load only requested columns of BaseEntity. Other columns are deferred.
+        Primary key is always loaded. Relationships behind requested `preloaded_properties` are loaded
+         by "SELECT ... WHERE fk IN (...)" for all selected objects at once.
+        Other names that are not columns are ignored.
+        :param list fields: names of requested fields or None for all fields. See `parse_fields` method.
+        :param required: names of columns that should be loaded anyway.
+        :return list: options for sqlalchemy query
+        """
+        options = [selectinload(getattr(self.BaseEntity, relationship))
+                   for name, relationship in self.preloaded_properties.items() if fields is None or name in fields]
+        if fields is not None:
+            columns = inspect(self.BaseEntity).column_attrs.keys()
+            options.append(load_only(*[name for name in columns if name in fields or name in required]))
+        return options
+
+    @staticmethod
+    def select_fields(model, fields_str):
+        """
+        Returns part of flask_restplus model with requested fields only. Unknown names are ignored.
+        :param model: flask_restplus model (or dictionary of fields) which describes the full object
+        :param str fields_str: comma-separated names of fields. All fields are returned, if it is empty.
+        :return: dictionary of fields, which can be passed to flask_restplus.marshal
+        """
+        fields = PaginationMixin.parse_fields(fields_str)
+        if fields is None:
+            return model
+        return OrderedDict((name, field) for name, field in model.items() if name in fields)
+
+    def paginate(self, args, extra_filters=(), columns=None):
         """
         Returns list of self.BaseEntity objects taking into account the parameters passed in args.
         :param args: dictionary with the following keys:
@@ -151,9 +361,12 @@ class PaginationMixin(FilterParser):
                      page - number of page to return. Ignored, if size is not positive integer.
                      filter - string specifying filtering rules. See `parse_filters` method.
                      order_by - string specifying order of objects in the selection. See `parse_order_clauses` method.
+                     fields - optional, comma-separated names of fields that should be loaded from the database.
+                              Other columns are deferred. See `loader_options` method.
         :param extra_filters: list of additional filters in sqlalchemy format, like 'User.id == 4'.
                               Use this parameter to restrict access to objects without changing filtering string.
-        :return: list of BaseEntity objects.
+        :param list columns: names of columns to select instead of whole objects. Rows are returned as named tuples.
+        :return: list of BaseEntity objects or rows.
         """
         self._check_entity_type()
 
@@ -167,6 +380,10 @@ class PaginationMixin(FilterParser):
         order_clauses = self.parse_order_clauses(sorting_str)
 
         query = self.BaseEntity.query.filter(parsed_filters, *extra_filters).order_by(*order_clauses)
+        if columns is not None:
+            query = query.with_entities(*[getattr(self.BaseEntity, name) for name in columns])
+        else:
+            query = query.options(*self.loader_options(self.parse_fields(args.get('fields'))))
         if size:
             start = offset + size * (page-1)
             return query.slice(start, start + size).all()
@@ -175,6 +392,102 @@ class PaginationMixin(FilterParser):
         else:
             return query.all()
 
+    def paginate_keyset(self, args, extra_filters=(), columns=None):
+        """
+        Keyset (cursor) pagination. Page is selected by condition on ORDER BY columns instead of OFFSET,
+         so the cost of a page does not depend on its number.
+        :param args: dictionary with the following keys:
+                     size - number of objects should be returned. No limitations if size is zero.
+                     cursor - string returned as next_cursor for the previous page. Empty for the first page.
+                     filter, order_by, fields - see `paginate` method. Should be the same for all pages.
+        :param extra_filters: see `paginate` method.
+        :param list columns: names of columns to select instead of whole objects. Rows are returned as named tuples,
+                             columns of ORDER BY criteria are appended to the requested ones if necessary.
+        :return: pair (list of BaseEntity objects or rows, next_cursor). next_cursor is None for the last page.
+        """
+        self._check_entity_type()
+
+        size = args.get('size')
+        cursor = args.get('cursor')
+        sorting_str = args.get('order_by') or ''
+        criteria = self._keyset_criteria(sorting_str)
+
+        query = self.BaseEntity.query.filter(self.parse_filters(args['filter']), *extra_filters)
+        if columns is not None:
+            names = list(columns) + [name for name, _ in criteria if name not in columns]
+            query = query.with_entities(*[getattr(self.BaseEntity, name) for name in names])
+        else:
+            # Values of criteria are used to build next cursor, so they are loaded even if not requested
+            query = query.options(*self.loader_options(self.parse_fields(args.get('fields')),
+                                                       required=[name for name, _ in criteria]))
+        if cursor:
+            query = query.filter(self._keyset_filter(criteria, self._decode_cursor(cursor, sorting_str, criteria)))
+        query = query.order_by(*self._criteria_to_clauses(criteria))
+        if not size:
+            return query.all(), None
+
+        # One extra row shows if there is the next page
+        entities = query.limit(size + 1).all()
+        if len(entities) <= size:
+            return entities, None
+        entities = entities[:size]
+        return entities, self._encode_cursor(sorting_str, [getattr(entities[-1], name) for name, _ in criteria])
+
+    def iterate_batches(self, args, extra_filters=(), batch_size=None, columns=None):
+        """
+        Yields all BaseEntity objects satisfying args by lists of batch_size objects.
+        Each batch is selected by a separate keyset query (see `paginate_keyset`), so neither the database driver
+         nor the session keep the whole result in memory.
+        :param args: see `paginate_keyset` method. Keys size and cursor are ignored.
+        :param extra_filters: see `paginate` method.
+        :param int batch_size: number of objects in one batch. Defaults to STREAM_BATCH_SIZE.
+        :param list columns: see `paginate_keyset` method.
+        """
+        args = dict(args, size=batch_size or app.config['STREAM_BATCH_SIZE'], cursor='')
+        while args['cursor'] is not None:
+            batch, args['cursor'] = self.paginate_keyset(args, extra_filters, columns)
+            if batch:
+                yield batch
+
+    def stream_json(self, args, model, extra_filters=(), batch_size=None):
+        """
+        Returns response with JSON array of all BaseEntity objects satisfying args, marshalled with the model.
+        The array is sent by chunks as batches are read from the database. See `iterate_batches` method.
+        :param model: flask_restplus model or dictionary of fields
+        :return: flask response object
+        """
+        batches = self.iterate_batches(args, extra_filters, batch_size)
+        # The first batch is read before the response is started, so errors in filter lead to the error response
+        first_batch = next(batches, [])
+
+        def generate():
+            yield '['
+            separator = ''
+            for batch in itertools.chain([first_batch], batches):
+                if batch:
+                    yield separator + ','.join(json.dumps(marshal(entity, model)) for entity in batch)
+                    separator = ','
+            yield ']'
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
+    def paginate_with_headers(self, args, extra_filters=()):
+        """
+        Chooses `paginate` or `paginate_keyset` depending on presence of cursor in args.
+        :return: pair (list of BaseEntity objects, dictionary with http headers)
+        """
+        headers = {}
+        if args.get('cursor') is not None:
+            entities, next_cursor = self.paginate_keyset(args, extra_filters)
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+        else:
+            entities = self.paginate(args, extra_filters)
+        if args.get('count'):
+            total = self.total_count(args['filter'], extra_filters, estimated=(args['count'] == 'estimated'))
+            headers['X-Total-Count'] = str(total)
+        return entities, headers
+
     def items_count(self, filters_str="", extra_filters=()):
         """
         Return amount of self.BaseEntity objects in the database satisfying given filters.
@@ -188,6 +501,46 @@ class PaginationMixin(FilterParser):
         parsed_filters = self.parse_filters(filters_str)
         return self.BaseEntity.query.filter(parsed_filters, *extra_filters).count()
 
+    def total_count(self, filters_str="", extra_filters=(), estimated=False):
+        """
+        Cached version of `items_count`. Cache is not used if extra_filters are provided.
+        Cached values live for COUNT_CACHE_TTL seconds or until `invalidate_counts` is called for BaseEntity.
+        :param str filters_str: see `items_count` method.
+        :param extra_filters: see `items_count` method.
+        :param bool estimated: use table statistics instead of COUNT(*) if there are no filters at all.
+                               Exact count is returned if statistics is not available.
+        :return int: number of BaseEntity objects.
+        """
+        self._check_entity_type()
+        if extra_filters:
+            return self.items_count(filters_str, extra_filters)
+        if estimated and not filters_str:
+            estimation = self._estimated_count()
+            if estimation is not None:
+                return estimation
+        return self.counts_cache.get_or_create((self.BaseEntity, filters_str or ''),
+                                               lambda: self.items_count(filters_str))
+
+    def _estimated_count(self):
+        """
+        :return: number of rows in BaseEntity table according to the database statistics or None if unknown.
+        """
+        bind = self.BaseEntity.query.session.get_bind(mapper=inspect(self.BaseEntity))
+        if bind.dialect.name != 'mysql':
+            return None
+        return bind.execute(
+            text('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                 'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name'),
+            table_name=self.BaseEntity.__table__.name
+        ).scalar()
+
+    @classmethod
+    def invalidate_counts(cls, entity_cls):
+        """
+        Drops cached counts of entity_cls. Must be called after any change of entity_cls objects or their relations.
+        """
+        cls.counts_cache.clear(lambda key: key[0] is entity_cls)
+
 
 class CsvMixin(PaginationMixin):
     def paginate(self, args, extra_filters=(), xfields=None, headers=None, additional_properties=None):
@@ -205,34 +558,72 @@ class CsvMixin(PaginationMixin):
         file = tempfile.NamedTemporaryFile('wt', suffix='.csv')
         csv_writer = csv.writer(file)
 
-        include_headers = (headers is not None)
+        names, properties = self._csv_properties(xfields, headers, additional_properties)
+        if headers is not None:
+            csv_writer.writerow(names)
+
+        for entity in entities:
+            csv_writer.writerow([getter(entity) for getter in properties])
+
+        file.flush()
+        return file
+
+    def stream(self, args, extra_filters=(), xfields=None, headers=None, additional_properties=None,
+               batch_size=None):
+        """
+        Return generator of csv text chunks: the line with headers (if provided) and then one chunk for each batch
+         of objects read from the database. Unlike `paginate`, neither the whole table nor temporary file is created.
+        Pass the result to `make_streaming_response`.
+        :param args: see PaginationMixin::iterate_batches. Page, size and offset are ignored.
+        :param batch_size: passed to the PaginationMixin::iterate_batches unchanged
+        Other parameters are the same as for `paginate` method.
+        """
+        # Errors in the filter are raised here, before the response is started
+        self.parse_filters(args['filter'])
+        names, properties = self._csv_properties(xfields, headers, additional_properties)
+        return self._generate_csv(args, extra_filters, names if headers is not None else None, properties, batch_size)
+
+    def _generate_csv(self, args, extra_filters, names, properties, batch_size):
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        if names is not None:
+            csv_writer.writerow(names)
+            yield flush()
+        for batch in self.iterate_batches(args, extra_filters, batch_size):
+            csv_writer.writerows([getter(entity) for getter in properties] for entity in batch)
+            yield flush()
+
+    def _csv_properties(self, xfields, headers, additional_properties):
+        """
+        Convert all properties that should be in the table (both object attributes and additional)
+         into list of strings for headers and list of functions: BaseEntity -> str for value.
+        Columns go in the order of xfields, if it is provided, otherwise in the order of table columns.
+        :return: pair (list of headers, list of functions)
+        """
         columns = self.BaseEntity.__table__.columns
-        if not include_headers:
+        if headers is None:
             headers = [None] * len(columns)
+        headers_by_name = OrderedDict((column.name, header) for header, column in zip(headers, columns))
 
-        # Convert all properties that should be in the table (both object attributes and additional)
-        #  into list of strings for headers and list of functions: BaseEntity -> str for value.
         properties = []
         names = []
-        # TODO: preserve order of properties from xfields
-        for header, column in zip(headers, columns):
-            if not xfields or column.name in xfields:
-                names.append(header)
-                properties.append(operator.attrgetter(column.name))
+        for name in (xfields or headers_by_name):
+            if name in headers_by_name:
+                names.append(headers_by_name[name])
+                properties.append(operator.attrgetter(name))
 
         if additional_properties:
             for header, getter in additional_properties:
                 names.append(header)
                 properties.append(getter)
-
-        if include_headers:
-            csv_writer.writerow(names)
-
-        for entity in entities:
-            csv_writer.writerow([getter(entity) for getter in properties])
-
-        file.flush()
-        return file
+        return names, properties
 
     @staticmethod
     def make_response(file, filename=None):
@@ -251,3 +642,30 @@ class CsvMixin(PaginationMixin):
             attachment_filename=filename,
             as_attachment=True
         )
+
+    @staticmethod
+    def make_streaming_response(chunks, filename=None, gzip=False):
+        """
+        Utility function. Sends csv chunks to the client as soon as they are produced. Sent data will not be cached.
+        :param chunks: iterable of strings, for example result of `stream` method
+        :param str filename: filename that will be shown to client
+        :param bool gzip: compress the response on the fly (Content-Encoding: gzip)
+        :return: flask http response object
+        """
+        chunks = (chunk.encode() for chunk in chunks)
+        headers = {'Cache-Control': 'no-cache'}
+        if filename:
+            headers['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        if gzip:
+            chunks = _gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks), mimetype='text/csv', headers=headers)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
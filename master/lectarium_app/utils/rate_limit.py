@@ -0,0 +1,68 @@
+__all__ = ['RateLimiter']
+import threading
+import time
+
+from lectarium_app.exceptions import RateLimitExceeded
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all threads of the process. Each key (for example, account login) has its own
+     bucket with `burst` tokens, refilled with `rate` tokens per second. Each request takes one token.
+    Requests that do not find a token wait in a queue. The queue is fair: each request reserves a token in advance,
+     so requests are served in order of arrival.
+    Waiting times are collected for each key, see `stats` method.
+    """
+    def __init__(self, rate, burst=1):
+        """
+        :param float rate: tokens per second. Non-positive value disables limiting.
+        :param int burst: capacity of a bucket, i.e. number of requests that may be sent at once after a pause
+        """
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # key -> (tokens, time of update). Negative tokens are reserved by waiting requests.
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, timeout=None):
+        """
+        Takes a token from the bucket of the key, waiting until it is available.
+        :param key: hashable key of the bucket
+        :param float timeout: maximal waiting time in seconds. None means waiting as long as necessary.
+        :return float: waiting time in seconds
+        Raises RateLimitExceeded without waiting, if the token is not available within timeout.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            metrics = self._metrics.setdefault(key, {'acquired': 0, 'rejected': 0, 'waiting': 0,
+                                                     'total_wait': 0.0, 'max_wait': 0.0})
+            if timeout is not None and wait > timeout:
+                self._buckets[key] = (tokens, now)
+                metrics['rejected'] += 1
+                raise RateLimitExceeded(key, wait)
+            self._buckets[key] = (tokens - 1, now)
+            metrics['acquired'] += 1
+            metrics['total_wait'] += wait
+            metrics['max_wait'] = max(metrics['max_wait'], wait)
+            if wait:
+                metrics['waiting'] += 1
+        if wait:
+            time.sleep(wait)
+            with self._lock:
+                metrics['waiting'] -= 1
+        return wait
+
+    def stats(self):
+        """
+        :return dict: key -> dictionary with numbers of acquired and rejected requests, number of requests waiting
+                      at the moment, total, average and maximal waiting time in seconds.
+        """
+        with self._lock:
+            return {key: dict(metrics, average_wait=metrics['total_wait'] / metrics['acquired']
+                                                     if metrics['acquired'] else 0.0)
+                    for key, metrics in self._metrics.items()}
@@ -0,0 +1,130 @@
+__all__ = ['ResponseCache', 'LocalCacheBackend', 'RedisCacheBackend', 'make_cache_backend']
+import hashlib
+import json
+import threading
+
+from lectarium_app import app
+from .cache import LRUCache
+
+try:
+    import redis
+except ImportError:
+    # Shared cache is optional: local backend works without redis
+    redis = None
+
+
+class LocalCacheBackend:
+    """
+    Cache backend which keeps values in memory of the current process. Writes made by other processes do not
+     invalidate it, so it is suitable for a single process (and tests) only.
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self._values = LRUCache(maxsize, ttl)
+        # Counters are kept apart from values, so they are never evicted
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def set(self, key, value):
+        self._values.put(key, value)
+
+    def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCacheBackend:
+    """
+    Cache backend shared by all processes. Values are stored as strings with expiration time.
+    """
+    def __init__(self, url, ttl=None):
+        if redis is None:
+            raise RuntimeError('Redis cache backend requires redis package')
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self._client.get(key)
+        return None if value is None else value.decode()
+
+    def set(self, key, value):
+        self._client.set(key, value, ex=int(self.ttl) if self.ttl else None)
+
+    def get_counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+def make_cache_backend():
+    """
+    Creates backend according to RESPONSE_CACHE_BACKEND setting: 'local' or 'redis'.
+    """
+    if app.config['RESPONSE_CACHE_BACKEND'] == 'redis':
+        return RedisCacheBackend(app.config['RESPONSE_CACHE_URL'], app.config['RESPONSE_CACHE_TTL'])
+    return LocalCacheBackend(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL'])
+
+
+class ResponseCache:
+    """
+    Cache of serialized responses (payload and headers) keyed by normalized request arguments.
+    All keys include the generation number of the namespace. `invalidate` increases the generation,
+     so all cached responses of the namespace become unreachable at once and expire later by themselves.
+    Usage:
+        key = cache.make_key(args)  # before reading the database
+        cached = cache.get(key)
+        if cached is None:
+            ...
+            cache.put(key, payload, headers)
+    The key must be built before the data is read: if a write happens in between, the response is stored
+     under the old generation and is never served.
+    """
+    def __init__(self, namespace, backend=None):
+        """
+        :param str namespace: prefix of keys, usually the name of the collection
+        :param backend: LocalCacheBackend, RedisCacheBackend or another object with the same methods.
+                        Defaults to the backend selected by the configuration. See `make_cache_backend`.
+        """
+        self.namespace = namespace
+        self.backend = backend if backend is not None else make_cache_backend()
+
+    @property
+    def _generation_key(self):
+        return '{}:generation'.format(self.namespace)
+
+    def make_key(self, args, *extra):
+        """
+        :param args: arguments of the request, like result of pagination_parser.parse_args()
+        :param extra: other values that affect the response, for example id of the user
+        :return str: key which does not depend on the order of arguments and omitted (None) arguments
+        """
+        normalized = sorted((name, value) for name, value in args.items() if value is not None)
+        digest = hashlib.sha1(json.dumps([normalized, extra], default=str).encode()).hexdigest()
+        return '{}:{}:{}'.format(self.namespace, self.backend.get_counter(self._generation_key), digest)
+
+    def get(self, key):
+        """
+        :return: pair (payload, headers) or None if the response is not cached
+        """
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        cached = json.loads(value)
+        return cached['payload'], cached['headers']
+
+    def put(self, key, payload, headers):
+        """
+        :param payload: JSON-serializable body of the response, for example result of flask_restplus.marshal
+        :param dict headers: headers of the response
+        """
+        self.backend.set(key, json.dumps({'payload': payload, 'headers': dict(headers)}))
+
+    def invalidate(self):
+        self.backend.incr(self._generation_key)
@@ -1,10 +1,16 @@
-from lectarium_app.global_routes import webinar_nsp, pagination_parser
-from flask_restplus import Resource
-from flask import request, g
-from lectarium_app import webinar_service, api
+from lectarium_app.global_routes import webinar_nsp, pagination_parser, export_parser, batch_parser
+from flask_restplus import Resource, marshal
+from flask import request, g, send_file
+from lectarium_app import webinar_service, clm_service, api, app
 from lectarium_app.exceptions import StatusChangeError, ClmOperationalError
-from lectarium_app.utils import PaginationMixin
-from lectarium_app.serializers import webinar_full_model, webinar_post_planned_model, webinar_post_uploaded_model
+from lectarium_app.utils import PaginationMixin, CsvMixin, ColumnarMixin, ExportJobs, ConditionalMixin, \
+    make_etag, is_conditional, is_not_modified, conditional_headers
+from lectarium_app.serializers import webinar_full_model, webinar_post_planned_model, webinar_post_uploaded_model, \
+    export_job_model, webinar_batch_model, webinar_bulk_patch_model, webinar_token_model, \
+    webinar_tokens_reserve_model
+
+
+export_jobs = ExportJobs()
 
 
 @webinar_nsp.route("/update_status/<int:webinar_id>")
@@ -18,32 +24,58 @@ class WebinarsStatus(Resource):
 
 
 @webinar_nsp.route('')
-class WebinarCollection(Resource, PaginationMixin):
+class WebinarCollection(Resource, ConditionalMixin):
     BaseEntity = webinar_service.Webinar
+    preloaded_properties = webinar_service.webinar_preloaded_properties
 
     @api.expect(pagination_parser)
-    @api.marshal_list_with(webinar_full_model)
+    @api.response(200, 'Success', [webinar_full_model])
+    @api.response(304, 'Not Modified')
     @privileges_required(clm_level=0)
     def get(self):
         """
         Получить список всех вебинаров
         """
-        return self.paginate(pagination_parser.parse_args())
+        args = pagination_parser.parse_args()
+        model = self.select_fields(webinar_full_model, args['fields'])
+        if args['stream'] and not args['size']:
+            return self.stream_json(args, model)
+        return self.cached_page(webinar_service.webinar_pages_cache, args, model, key_extra=('webinars',))
 
 
 @webinar_nsp.route('/view')
-class WebinarViewCollection(Resource, PaginationMixin):
+class WebinarViewCollection(Resource, ConditionalMixin):
     BaseEntity = webinar_service.Webinar
+    preloaded_properties = webinar_service.webinar_preloaded_properties
 
     @api.expect(pagination_parser)
-    @api.marshal_list_with(webinar_full_model)
+    @api.response(200, 'Success', [webinar_full_model])
+    @api.response(304, 'Not Modified')
     @privileges_required(clm_level=0)
     def get(self):
         """
         Получить список всех вебинаров, доступных пользователю
         """
         #TODO: отдать в сервис с юзерами и получить проаннотированный is_payed ответ
-        return self.paginate(pagination_parser.parse_args())
+        args = pagination_parser.parse_args()
+        model = self.select_fields(webinar_full_model, args['fields'])
+        return self.cached_page(webinar_service.webinar_pages_cache, args, model, key_extra=('view',))
+
+
+@webinar_nsp.route('/batch')
+class WebinarBatch(Resource):
+    @api.expect(batch_parser)
+    @api.marshal_with(webinar_batch_model)
+    @privileges_required(clm_level=0)
+    def get(self):
+        """
+        Получить несколько вебинаров по списку id одним запросом. Ненайденные id перечисляются в missing
+        """
+        ids = batch_parser.parse_args()['ids']
+        if len(ids) > app.config['BATCH_FETCH_MAX_IDS']:
+            api.abort(400, 'Too many ids, maximum is {}'.format(app.config['BATCH_FETCH_MAX_IDS']))
+        webinars, missing = webinar_service.get_webinars_by_ids(ids)
+        return {'items': webinars, 'missing': missing}
 
 
 @webinar_nsp.route('/planned')
@@ -86,15 +118,86 @@ class WebinarPost(Resource):
         return webinar
 
 
+def _get_bulk_payload():
+    """
+    Возвращает список объектов из тела запроса к bulk-ресурсу, проверяя его размер
+    """
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        api.abort(400, 'Non-empty list of webinars expected')
+    if len(items) > app.config['BULK_MAX_SIZE']:
+        api.abort(400, 'Too many webinars, maximum is {}'.format(app.config['BULK_MAX_SIZE']))
+    return items
+
+
+@webinar_nsp.route('/planned/bulk')
+class WebinarPlannedBulkPost(Resource):
+    @api.expect([webinar_post_planned_model])
+    @api.marshal_with(webinar_full_model, as_list=True)
+    @privileges_required(clm_level=1)
+    def post(self):
+        """
+        Создать пакет вебинаров в одной транзакции. Если хотя бы один вебинар некорректен, не создается ни один
+        """
+        return _create_webinars('planned')
+
+
+@webinar_nsp.route('/uploaded/bulk')
+class WebinarUploadedBulkPost(Resource):
+    @api.expect([webinar_post_uploaded_model])
+    @api.marshal_with(webinar_full_model, as_list=True)
+    @privileges_required(clm_level=1)
+    def post(self):
+        """
+        Создать пакет загруженных вебинаров в одной транзакции
+        """
+        return _create_webinars('uploaded')
+
+
+def _create_webinars(post_type):
+    items = _get_bulk_payload()
+    ok, reasons = webinar_service.validate_webinars_post(post_type, items)
+    if not ok:
+        api.abort(400, 'Invalid webinars', errors=reasons)
+    webinar_ids = webinar_service.create_webinars(g.current_user, items)
+    return webinar_service.get_webinars_by_ids(webinar_ids)[0]
+
+
+@webinar_nsp.route('/bulk')
+class WebinarBulkPatch(Resource):
+    @api.expect([webinar_bulk_patch_model])
+    @api.marshal_with(webinar_full_model, as_list=True)
+    @privileges_required(clm_level=1)
+    def patch(self):
+        """
+        Редактировать пакет вебинаров в одной транзакции. Каждый элемент содержит webinar_id и изменяемые поля
+        """
+        items = _get_bulk_payload()
+        ok, reasons = webinar_service.validate_webinars_patch(items)
+        if not ok:
+            api.abort(403, 'Invalid changes', errors=reasons)
+        webinar_ids = webinar_service.update_webinars(items)
+        return webinar_service.get_webinars_by_ids(webinar_ids)[0]
+
+
 @webinar_nsp.route('/<int:webinar_id>')
 class WebinarItem(Resource):
-    @api.marshal_with(webinar_full_model)
+    @api.response(200, 'Success', webinar_full_model)
+    @api.response(304, 'Not Modified')
     @privileges_required(clm_level=0)
     def get(self, webinar_id):
         """
-        Получить один вебинар по его id
+        Получить один вебинар по его id. Поддерживает If-None-Match и If-Modified-Since
         """
-        return webinar_service.get_webinar(webinar_id)
+        if is_conditional():
+            # Проверка по версии не требует загрузки и сериализации вебинара
+            version, updated_at = webinar_service.get_webinar_version(webinar_id)
+            etag = make_etag('webinar', webinar_id, version)
+            if is_not_modified(etag, updated_at):
+                return None, 304, conditional_headers(etag, updated_at)
+        webinar = webinar_service.get_webinar(webinar_id)
+        etag = make_etag('webinar', webinar_id, webinar.version)
+        return marshal(webinar, webinar_full_model), 200, conditional_headers(etag, webinar.updated_at)
 
     @api.expect(webinar_full_model)
     @api.marshal_with(webinar_full_model)
@@ -125,3 +228,138 @@ class WebinarItem(Resource):
 
         webinar_service.delete_webinar(webinar_id)
         return {}
+
+
+def _get_webinar_with_tokens(webinar_id):
+    """
+    Возвращает вебинар, для которого выдаются токены. Отвечает 404, если вебинара нет, и 409, если у него нет комнаты
+     или он уже закончился
+    """
+    webinar = webinar_service.get_webinar(webinar_id)
+    if not webinar_service.can_have_tokens(webinar):
+        api.abort(409, 'Webinar {} has no tokens in status {}'.format(webinar_id, webinar.status))
+    return webinar
+
+
+@webinar_nsp.route('/<int:webinar_id>/token')
+class WebinarTokenClaim(Resource):
+    @api.response(200, 'Success', webinar_token_model)
+    @api.response(409, 'The webinar has no room or is already finished')
+    @api.response(503, 'No free tokens, the pool is being refilled')
+    @privileges_required(clm_level=0)
+    def post(self, webinar_id):
+        """
+        Получить токен пользователя для входа в вебинар. Повторные запросы возвращают тот же токен
+        """
+        webinar = _get_webinar_with_tokens(webinar_id)
+        wtoken = webinar_service.claim_token(webinar_id, g.current_user.lect_id)
+        if wtoken is None:
+            return {'message': 'No free tokens for the webinar, try again later'}, 503, \
+                   {'Retry-After': str(app.config['TOKEN_CLAIM_RETRY_AFTER'])}
+        # Hash of a reserved token is usually computed in advance, otherwise it is requested from ClickMeeting
+        webinar_service.get_autologin_hash(webinar, g.current_user, wtoken)
+        return marshal(wtoken, webinar_token_model)
+
+
+@webinar_nsp.route('/<int:webinar_id>/tokens/reserve')
+class WebinarTokenReserve(Resource):
+    @api.expect(webinar_tokens_reserve_model)
+    @api.response(200, 'Success', webinar_tokens_reserve_model)
+    @api.response(409, 'The webinar has no room or is already finished')
+    @privileges_required(clm_level=1)
+    def post(self, webinar_id):
+        """
+        Заранее выдать токены пользователям, записанным на вебинар. Их autologin hash будут получены до начала вебинара.
+        В ответе - пользователи, которым не хватило свободных токенов
+        """
+        _get_webinar_with_tokens(webinar_id)
+        lect_ids = request.get_json()['lect_ids']
+        if len(lect_ids) > app.config['BULK_MAX_SIZE']:
+            api.abort(400, 'Too many users, maximum is {}'.format(app.config['BULK_MAX_SIZE']))
+        return {'lect_ids': webinar_service.reserve_tokens(webinar_id, lect_ids)}
+
+
+@webinar_nsp.route('/clm_metrics')
+class ClmMetrics(Resource):
+    @privileges_required(clm_level=1)
+    def get(self):
+        """
+        Получить статистику ожидания в очереди запросов к ClickMeeting по учетным записям (для текущего процесса)
+        """
+        return clm_service.rate_limiter.stats()
+
+
+@webinar_nsp.route('/exports')
+class WebinarExportCollection(Resource):
+    @api.expect(export_parser)
+    @api.marshal_with(export_job_model, code=202)
+    @privileges_required(clm_level=1)
+    def post(self):
+        """
+        Запустить выгрузку вебинаров в csv или parquet. Одинаковые выгрузки в течение EXPORT_TTL используют один файл
+        """
+        args = export_parser.parse_args()
+        xfields = PaginationMixin.parse_fields(args['xfields'])
+        if args['format'] == 'parquet':
+            job_id = export_jobs.submit(ColumnarMixin(webinar_service.Webinar), args, xfields, format_='parquet')
+        else:
+            headers = [column.name for column in webinar_service.Webinar.__table__.columns]
+            job_id = export_jobs.submit(CsvMixin(webinar_service.Webinar), args, xfields, headers)
+        return {'job_id': job_id, 'status': export_jobs.status(job_id)}, 202
+
+
+@webinar_nsp.route('/exports/<string:job_id>')
+class WebinarExportItem(Resource):
+    @api.marshal_with(export_job_model)
+    @privileges_required(clm_level=1)
+    def get(self, job_id):
+        """
+        Получить состояние выгрузки
+        """
+        status = export_jobs.status(job_id)
+        if status is None:
+            api.abort(404, 'Export {} not found or expired'.format(job_id))
+        return {'job_id': job_id, 'status': status, 'error': export_jobs.error(job_id)}
+
+
+@webinar_nsp.route('/exports/<string:job_id>/file')
+class WebinarExportFile(Resource):
+    @privileges_required(clm_level=1)
+    def get(self, job_id):
+        """
+        Скачать готовую выгрузку
+        """
+        if export_jobs.status(job_id) != ExportJobs.DONE:
+            api.abort(404, 'Export {} is not ready'.format(job_id))
+        return send_file(export_jobs.path(job_id), cache_timeout=0, mimetype=export_jobs.mimetype(job_id),
+                         attachment_filename='webinars.' + export_jobs.format_of(job_id), as_attachment=True)
+
+
+@webinar_nsp.route('/arrow')
+class WebinarArrowExport(Resource, ColumnarMixin):
+    BaseEntity = webinar_service.Webinar
+
+    @api.expect(export_parser)
+    @privileges_required(clm_level=1)
+    def get(self):
+        """
+        Выгрузить вебинары в формате Arrow IPC stream с сохранением типов колонок
+        """
+        args = export_parser.parse_args()
+        chunks = self.stream_arrow(args, xfields=self.parse_fields(args['xfields']))
+        return self.make_arrow_response(chunks, 'webinars.arrows')
+
+
+@webinar_nsp.route('/tokens/arrow')
+class WebinarTokenArrowExport(Resource, ColumnarMixin):
+    BaseEntity = webinar_service.WebinarToken
+
+    @api.expect(export_parser)
+    @privileges_required(clm_level=1)
+    def get(self):
+        """
+        Выгрузить токены вебинаров (без самих токенов) в формате Arrow IPC stream
+        """
+        args = export_parser.parse_args()
+        chunks = self.stream_arrow(args, xfields=self.parse_fields(args['xfields']))
+        return self.make_arrow_response(chunks, 'webinars_tokens.arrows')
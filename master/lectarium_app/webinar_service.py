@@ -1,13 +1,81 @@
-from lectarium_app import session, clm_service, logger, executor
-from lectarium_app.models.webinar_entities import Webinar, WebinarToken
-from lectarium_app.exceptions import StatusChangeError, ClmOperationalError
+from lectarium_app import app, session, clm_service, clm_async, logger, executor
+from lectarium_app.models import parse_date
+from lectarium_app.models.webinar_entities import Webinar, WebinarToken, WebinarTokenPool, WebinarProduct, \
+    WebinarSubject, WebinarCourse
+from lectarium_app.exceptions import StatusChangeError, ClmOperationalError, TokenLimitError
+from lectarium_app.utils import PaginationMixin, ResponseCache
+from collections import defaultdict
 from datetime import datetime, timedelta
+import threading
+from sqlalchemy import bindparam, func, or_, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+
+# Свойства Webinar, которые строятся по связанным объектам: название свойства -> relationship
+webinar_preloaded_properties = {
+    'products': 'webinars_products',
+    'subjects': 'webinars_subjects',
+    'courses': 'webinars_courses',
+}
+
+# Свойства Webinar, которые хранятся в отдельных таблицах: название свойства -> (модель, колонка со значением)
+webinar_tag_models = {
+    'products': (WebinarProduct, 'product'),
+    'subjects': (WebinarSubject, 'subject'),
+    'courses': (WebinarCourse, 'course'),
+}
+
+# Готовые ответы со списками вебинаров, сбрасываются в invalidate_webinar_caches
+webinar_pages_cache = ResponseCache('webinars')
+
+
+def invalidate_webinar_caches():
+    """
+    Сбрасывает закэшированные данные о вебинарах. Вызывается после каждого изменения вебинаров или их токенов
+    """
+    PaginationMixin.invalidate_counts(Webinar)
+    webinar_pages_cache.invalidate()
 
 
 def get_web(webinar_id):
     return Webinar.query.get_or_404(webinar_id)
 
 
+def get_webinar_version(webinar_id):
+    """
+    Возвращает версию вебинара и время его последнего изменения, не загружая остальные поля
+    :return: pair (version, updated_at)
+    """
+    return Webinar.query.with_entities(Webinar.version, Webinar.updated_at)\
+        .filter(Webinar.webinar_id == webinar_id).first_or_404()
+
+
+def touch_webinar(webinar):
+    """
+    Увеличивает версию вебинара. Вызывается перед сохранением каждого изменения вебинара.
+    updated_at обновляется автоматически
+    """
+    # Выражение вычисляется в базе данных, поэтому одновременные изменения не теряют увеличения версии
+    webinar.version = Webinar.version + 1
+
+
+def get_webinars_by_ids(webinar_ids):
+    """
+    Загружает вебинары одним запросом WHERE webinar_id IN (...).
+    Связанные продукты, предметы и курсы загружаются для всех вебинаров сразу, по одному запросу на связь
+    :param webinar_ids: список id, может содержать повторы
+    :return: pair (list of webinars in order of webinar_ids without duplicates, list of ids that were not found)
+    """
+    webinar_ids = list(dict.fromkeys(webinar_ids))
+    if not webinar_ids:
+        return [], []
+    options = [selectinload(getattr(Webinar, relationship)) for relationship in webinar_preloaded_properties.values()]
+    found = {webinar.webinar_id: webinar
+             for webinar in Webinar.query.filter(Webinar.webinar_id.in_(webinar_ids)).options(*options)}
+    return [found[i] for i in webinar_ids if i in found], [i for i in webinar_ids if i not in found]
+
+
 def update_web_status(webinar_id, status):
     all_possible_statuses = {"CREATED": ["PLANNED"],
                              "PLANNED": ["BEGINNING"],
@@ -21,15 +89,17 @@ def update_web_status(webinar_id, status):
     previous_status = current_web.status
     if status in all_possible_statuses[previous_status]:
         current_web.status = status
+        touch_webinar(current_web)
         session.add(current_web)
         session.commit()
+        invalidate_webinar_caches()
         return current_web
     else:
         raise StatusChangeError(previous_status, status)
 
 
 def get_all_webs_by_status(status):
-    return Webinar.query.filter_by(status).all()
+    return Webinar.query.filter_by(status=status).all()
 
 
 def get_webinar(webinar_id):
@@ -38,24 +108,361 @@ def get_webinar(webinar_id):
 
 @executor.job
 def create_or_update_webinars_tokens(webinar_id):
+    """
+    Создает пул токенов вебинара и заполняет его до верхней границы. Дальше пул пополняется задачей
+     webinars_token_pools по мере выдачи токенов
+    """
     logger.info('Creating wtokens')
     try:
-        webinar = Webinar.query.get_or_404(webinar_id)
-        status, tokens = clm_service.generate_and_get_tokens(webinar.room_id, webinar.cm_account_login,
-                                                             webinar.cm_account.userplan * 4)
-        if status['new']:
-            for token in tokens:
-                session.add(WebinarToken(webinar=webinar, user=None, token=token))
-        else:
-            for token in tokens:
-                if not WebinarToken.query.filter(WebinarToken.token == token).one_or_none():
-                    session.add(WebinarToken(webinar=webinar, user=None, token=token))
-
-        session.commit()
+        added = refill_token_pool(webinar_id)
+        invalidate_webinar_caches()
     except Exception as e:
         logger.error('Error while generating wtokens: %s', e)
+        session.rollback()
+    else:
+        logger.info('Creating wtokens completed, %s tokens added', added)
+    finally:
+        with _refills_lock:
+            _refills_submitted.discard(webinar_id)
+
+
+# Максимальное количество значений в одном условии IN
+_IN_CHUNK_SIZE = 1000
+
+
+def _store_tokens(webinar, tokens):
+    """
+    Сохраняет токены, которых еще нет в базе данных: существующие токены ищутся запросами WHERE token IN (...)
+     по уникальному индексу, новые добавляются одним пакетным INSERT
+    :return int: number of added tokens
+    """
+    tokens = list(dict.fromkeys(tokens))
+    existing = set()
+    for start in range(0, len(tokens), _IN_CHUNK_SIZE):
+        chunk = tokens[start:start + _IN_CHUNK_SIZE]
+        existing.update(token for token, in session.query(WebinarToken.token).filter(WebinarToken.token.in_(chunk)))
+    rows = [{'webinar_id': webinar.webinar_id, 'token': token} for token in tokens if token not in existing]
+    if rows:
+        session.bulk_insert_mappings(WebinarToken, rows)
+    return len(rows)
+
+
+def refill_token_pool(webinar_id):
+    """
+    Пополняет пул токенов вебинара порциями по TOKEN_POOL_REFILL_BATCH токенов до TOKEN_POOL_HIGH_WATERMARK свободных
+     токенов или до ограничения комнаты. Каждая порция - отдельный запрос к ClickMeeting и отдельная транзакция
+    :return int: number of added tokens
+    """
+    added = 0
+    while True:
+        batch_added = _refill_token_pool_batch(webinar_id)
+        if not batch_added:
+            return added
+        added += batch_added
+
+
+def _refill_token_pool_batch(webinar_id):
+    """
+    Генерирует одну порцию токенов, если свободных токенов меньше TOKEN_POOL_HIGH_WATERMARK и ограничение комнаты
+     позволяет. Строка пула блокируется только на время подсчета токенов: запрос к ClickMeeting выполняется вне
+     транзакции, а токены сохраняются отдельной короткой транзакцией. Одновременные пополнения одного вебинара могут
+     превысить верхнюю границу на порцию, но не сохранят один токен дважды благодаря уникальному индексу token
+    :return int: number of added tokens
+    """
+    webinar = get_webinar(webinar_id)
+    if not can_have_tokens(webinar):
+        return 0
+    room_id, cm_account_login = webinar.room_id, webinar.cm_account_login
+    pool = _lock_token_pool(webinar_id, cm_account_login)
+    how_many = min(app.config['TOKEN_POOL_REFILL_BATCH'], app.config['TOKEN_POOL_HIGH_WATERMARK'] - pool.free)
+    if pool.allowed is not None:
+        how_many = min(how_many, pool.allowed - pool.size)
+    session.commit()
+    if how_many <= 0:
+        return 0
+
+    allowed = None
+    try:
+        tokens = clm_service.generate_tokens(room_id, cm_account_login, how_many)
+    except TokenLimitError as e:
+        # Токены могли быть сгенерированы ранее без сохранения в базе данных: забираем все токены комнаты
+        _, generated, allowed = e.args
+        cm_account = clm_service.get_cm_account(cm_account_login)
+        if cm_account.userplan * 4 != allowed:
+            clm_service.update_cm_account(cm_account_login, userplan=allowed // 4)
+            logger.info('Updated userplan for {} to {} viewers'.format(cm_account_login, allowed // 4))
+        tokens = clm_service.get_tokens(room_id, cm_account_login)
+    session.commit()
+
+    try:
+        added = _store_tokens(webinar, tokens)
+    except IntegrityError:
+        # Часть токенов одновременно сохранило другое пополнение
+        session.rollback()
+        added = _store_tokens(webinar, tokens)
+    pool = _lock_token_pool(webinar_id, cm_account_login)
+    if allowed is not None:
+        pool.allowed = allowed
+    pool.refilled_at = datetime.now()
+    session.commit()
+    return added
+
+
+def _lock_token_pool(webinar_id, cm_account_login):
+    """
+    Блокирует строку пула до конца транзакции и пересчитывает его счетчики. Создает пул, если его еще нет
+    """
+    pool = WebinarTokenPool.query.filter_by(webinar_id=webinar_id).with_for_update().one_or_none()
+    counts = _count_tokens(WebinarToken.query.filter(WebinarToken.webinar_id == webinar_id)).first()
+    size, claimed = counts[1:] if counts else (0, 0)
+    if pool is None:
+        cm_account = clm_service.get_cm_account(cm_account_login)
+        pool = WebinarTokenPool(webinar_id=webinar_id, size=size, claimed=claimed, allowed=cm_account.userplan * 4)
+        session.add(pool)
     else:
-        logger.info('Creating wtokens completed')
+        # Токены выдаются без блокировки пула (см. claim_token), поэтому счетчики берутся из webinars_tokens
+        pool.size, pool.claimed = size, claimed
+    return pool
+
+
+def refill_token_pools():
+    """
+    Пополняет пулы токенов вебинаров, в которых свободных токенов меньше TOKEN_POOL_LOW_WATERMARK
+    :return int: number of refilled pools
+    """
+    free = WebinarTokenPool.size - WebinarTokenPool.claimed
+    webinar_ids = [webinar_id for webinar_id, in session.query(WebinarTokenPool.webinar_id).join(Webinar).filter(
+        Webinar.status.in_(('PLANNED', 'BEGINNING', 'IN_PROGRESS')), Webinar.room_id.isnot(None),
+        free < app.config['TOKEN_POOL_LOW_WATERMARK'],
+        or_(WebinarTokenPool.allowed.is_(None), WebinarTokenPool.size < WebinarTokenPool.allowed)
+    )]
+    for webinar_id in webinar_ids:
+        try:
+            refill_token_pool(webinar_id)
+        except Exception as e:
+            logger.error('Error while refilling token pool of webinar #%s: %s', webinar_id, e)
+            session.rollback()
+    if webinar_ids:
+        invalidate_webinar_caches()
+    return len(webinar_ids)
+
+
+# Вебинары, пополнение пулов которых уже поставлено в очередь этим процессом
+_refills_submitted = set()
+_refills_lock = threading.Lock()
+
+
+def _submit_refill(webinar_id):
+    with _refills_lock:
+        if webinar_id in _refills_submitted:
+            return
+        _refills_submitted.add(webinar_id)
+    create_or_update_webinars_tokens.submit(webinar_id)
+
+
+# MySQL не позволяет выбирать из обновляемой таблицы в подзапросе UPDATE, а SKIP LOCKED не поддерживается
+#  with_for_update в SQLAlchemy 1.3, поэтому свободные строки выбираются отдельным запросом
+_select_free_tokens_mysql = text(
+    'SELECT id FROM webinars_tokens WHERE webinar_id = :webinar_id AND lect_id IS NULL '
+    'ORDER BY id LIMIT :limit FOR UPDATE SKIP LOCKED'
+)
+
+
+def _take_free_token(webinar_id, lect_id):
+    """
+    Занимает одну свободную строку webinars_tokens для пользователя
+    :return bool: False if the webinar has no free tokens
+    """
+    if session.get_bind().dialect.name == 'mysql':
+        # Строки, заблокированные одновременными выдачами, пропускаются, поэтому выдачи не ждут друг друга
+        token_id = session.execute(_select_free_tokens_mysql, {'webinar_id': webinar_id, 'limit': 1}).scalar()
+        if token_id is None:
+            return False
+        WebinarToken.query.filter(WebinarToken.id == token_id)\
+            .update({'lect_id': lect_id}, synchronize_session=False)
+        return True
+    # Остальные СУБД (SQLite в тестах): один UPDATE с подзапросом, условие lect_id IS NULL защищает от двойной выдачи
+    free_id = session.query(WebinarToken.id)\
+        .filter(WebinarToken.webinar_id == webinar_id, WebinarToken.lect_id.is_(None))\
+        .order_by(WebinarToken.id).limit(1).as_scalar()
+    return WebinarToken.query.filter(WebinarToken.id == free_id, WebinarToken.lect_id.is_(None))\
+        .update({'lect_id': lect_id}, synchronize_session=False) == 1
+
+
+def _has_free_tokens(webinar_id, how_many):
+    """
+    Проверяет, что у вебинара есть хотя бы how_many свободных токенов. Читается не больше how_many строк индекса
+    """
+    if how_many <= 0:
+        return True
+    return session.query(WebinarToken.id)\
+        .filter(WebinarToken.webinar_id == webinar_id, WebinarToken.lect_id.is_(None))\
+        .order_by(WebinarToken.id).offset(how_many - 1).limit(1).first() is not None
+
+
+def can_have_tokens(webinar):
+    """
+    Токены выдаются и пулы пополняются только для вебинаров с комнатой в ClickMeeting, которые еще не закончились
+    """
+    return webinar.room_id is not None and webinar.status in ('PLANNED', 'BEGINNING', 'IN_PROGRESS')
+
+
+def claim_token(webinar_id, lect_id):
+    """
+    Выдает пользователю свободный токен вебинара. Повторный вызов для того же пользователя возвращает тот же токен.
+    Вебинар должен быть проверен can_have_tokens.
+    Если свободных токенов меньше TOKEN_POOL_LOW_WATERMARK, в фоне запускается пополнение пула.
+    Счетчик claimed пула здесь не меняется: одна строка пула на все выдачи вебинара сделала бы их последовательными.
+     Он пересчитывается при пополнении и задачей webinars_token_pools
+    :return WebinarToken: token of the user or None if the webinar has no free tokens
+    """
+    wtoken = WebinarToken.query.filter_by(webinar_id=webinar_id, lect_id=lect_id).one_or_none()
+    if wtoken is not None:
+        return wtoken
+
+    try:
+        taken = _take_free_token(webinar_id, lect_id)
+        session.commit()
+    except IntegrityError:
+        # Одновременный запрос того же пользователя уже получил токен: (webinar_id, lect_id) уникальны
+        session.rollback()
+        taken = True
+
+    if not _has_free_tokens(webinar_id, app.config['TOKEN_POOL_LOW_WATERMARK']):
+        _submit_refill(webinar_id)
+    if not taken:
+        return None
+    return WebinarToken.query.filter_by(webinar_id=webinar_id, lect_id=lect_id).one()
+
+
+def reserve_tokens(webinar_id, lect_ids):
+    """
+    Заранее выдает токены пользователям, записанным на вебинар, чтобы задача webinars_autologin_hashes получила
+     для них autologin hash до начала вебинара. Тогда вход в вебинар - один запрос по индексу (webinar_id, lect_id).
+    Пользователи, у которых уже есть токен, пропускаются
+    :param lect_ids: ids of users
+    :return list: ids of users left without token, because the webinar has not enough free tokens
+    """
+    lect_ids = list(dict.fromkeys(lect_ids))
+    with_tokens = _users_with_tokens(webinar_id, lect_ids)
+    without_tokens = [lect_id for lect_id in lect_ids if lect_id not in with_tokens]
+    if without_tokens:
+        if session.get_bind().dialect.name == 'mysql':
+            token_ids = [token_id for token_id, in session.execute(
+                _select_free_tokens_mysql, {'webinar_id': webinar_id, 'limit': len(without_tokens)})]
+        else:
+            token_ids = [token_id for token_id, in session.query(WebinarToken.id).filter(
+                WebinarToken.webinar_id == webinar_id, WebinarToken.lect_id.is_(None)
+            ).order_by(WebinarToken.id).limit(len(without_tokens))]
+        # Условие lect_id IS NULL не дает занять токен, выданный одновременным запросом
+        statement = WebinarToken.__table__.update()\
+            .where((WebinarToken.id == bindparam('b_id')) & WebinarToken.lect_id.is_(None))\
+            .values(lect_id=bindparam('b_lect_id'))
+        try:
+            if token_ids:
+                session.execute(statement, [{'b_id': token_id, 'b_lect_id': lect_id}
+                                            for token_id, lect_id in zip(token_ids, without_tokens)])
+            session.commit()
+        except IntegrityError:
+            # Кто-то из пользователей одновременно получил токен сам, остальным токены выдаются по одному
+            session.rollback()
+            for lect_id in without_tokens:
+                claim_token(webinar_id, lect_id)
+
+    if not _has_free_tokens(webinar_id, app.config['TOKEN_POOL_LOW_WATERMARK']):
+        _submit_refill(webinar_id)
+    with_tokens = _users_with_tokens(webinar_id, lect_ids)
+    return [lect_id for lect_id in lect_ids if lect_id not in with_tokens]
+
+
+def _users_with_tokens(webinar_id, lect_ids):
+    """
+    :return set: ids of users from lect_ids, who have tokens for the webinar
+    """
+    result = set()
+    for start in range(0, len(lect_ids), _IN_CHUNK_SIZE):
+        chunk = lect_ids[start:start + _IN_CHUNK_SIZE]
+        result.update(lect_id for lect_id, in session.query(WebinarToken.lect_id).filter(
+            WebinarToken.webinar_id == webinar_id, WebinarToken.lect_id.in_(chunk)))
+    return result
+
+
+def _count_tokens(query):
+    """
+    :return: query of rows (webinar_id, number of tokens, number of claimed tokens)
+    """
+    return query.with_entities(WebinarToken.webinar_id, func.count(WebinarToken.id), func.count(WebinarToken.lect_id))\
+        .group_by(WebinarToken.webinar_id)
+
+
+def sync_token_pools():
+    """
+    Пересчитывает размеры пулов и количество выданных токенов по таблице webinars_tokens для текущих вебинаров
+    """
+    active_pools = session.query(WebinarTokenPool.webinar_id).join(Webinar)\
+        .filter(Webinar.status.in_(('PLANNED', 'BEGINNING', 'IN_PROGRESS')))
+    counts = _count_tokens(WebinarToken.query.filter(WebinarToken.webinar_id.in_(active_pools.subquery())))
+    session.bulk_update_mappings(WebinarTokenPool, [
+        {'webinar_id': webinar_id, 'size': size, 'claimed': claimed} for webinar_id, size, claimed in counts
+    ])
+    session.commit()
+
+
+def precompute_autologin_hashes(batch_size):
+    """
+    Запрашивает autologin hash для токенов, выданных пользователям, у вебинаров в статусах PLANNED и BEGINNING.
+    Запросы к ClickMeeting выполняются конкурентно (см. clm_async), результаты сохраняются одним UPDATE.
+    Время неудачных запросов сохраняется, такие токены пропускаются в течение AUTOLOGIN_HASH_RETRY_INTERVAL,
+     поэтому токены, для которых ClickMeeting всегда отвечает ошибкой, не задерживают остальные
+    :param int batch_size: maximal number of hashes requested by one call
+    :return: pair (saved, failed) - numbers of saved hashes and of failed requests
+    """
+    retry_after = datetime.now() - timedelta(seconds=app.config['AUTOLOGIN_HASH_RETRY_INTERVAL'])
+    wtokens = WebinarToken.query.join(Webinar)\
+        .filter(Webinar.status.in_(('PLANNED', 'BEGINNING')), Webinar.room_id.isnot(None),
+                WebinarToken.lect_id.isnot(None), WebinarToken.autologin_hash.is_(None),
+                or_(WebinarToken.hash_failed_at.is_(None), WebinarToken.hash_failed_at < retry_after))\
+        .options(selectinload(WebinarToken.user).selectinload('profile'), selectinload(WebinarToken.webinar))\
+        .order_by(Webinar.begin_date, WebinarToken.id).limit(batch_size).all()
+    if not wtokens:
+        return 0, 0
+
+    # Параметры строятся здесь: объекты sqlalchemy не передаются в другие потоки
+    args_list = [(wtoken.webinar.cm_account_login, wtoken.webinar.room_id,
+                  clm_service.autologin_params(wtoken.user, wtoken.token)) for wtoken in wtokens]
+    hashes = clm_async.get_clm_client().run_many(clm_service.request_autologin_hash, args_list)
+
+    failed_at = datetime.now()
+    rows = []
+    failed = 0
+    for wtoken, autologin_hash in zip(wtokens, hashes):
+        if isinstance(autologin_hash, Exception):
+            logger.error('Error while getting autologin hash for %s: %s', wtoken, autologin_hash)
+            rows.append({'id': wtoken.id, 'hash_failed_at': failed_at})
+            failed += 1
+        else:
+            rows.append({'id': wtoken.id, 'autologin_hash': autologin_hash, 'hash_failed_at': None})
+    session.bulk_update_mappings(WebinarToken, rows)
+    session.commit()
+    return len(rows) - failed, failed
+
+
+def get_autologin_hash(webinar, lect_user, wtoken=None):
+    """
+    Возвращает autologin hash пользователя для вебинара.
+    Обычно hash вычислен заранее (см. reserve_tokens), и это один запрос по уникальному индексу (webinar_id, lect_id).
+    Иначе hash запрашивается у ClickMeeting и сохраняется
+    :param WebinarToken wtoken: token of the user, if it is already loaded (for example, by claim_token)
+    :return: hash or None if the user has no token for the webinar
+    """
+    if wtoken is None:
+        wtoken = WebinarToken.query.filter_by(webinar_id=webinar.webinar_id, lect_id=lect_user.lect_id).one_or_none()
+    if wtoken is None:
+        return None
+    if wtoken.autologin_hash is None:
+        wtoken.autologin_hash = clm_service.get_autologin_hash(lect_user, webinar, wtoken.token)
+        session.commit()
+    return wtoken.autologin_hash
 
 
 # Округление времени до целых минут
@@ -85,29 +492,257 @@ def create_webinar(initiator, data):
     webinar = Webinar(**data)
     session.add(webinar)
     session.commit()
+    invalidate_webinar_caches()
     # We need webinar in database to create WebinarToken item
     create_or_update_webinars_tokens.submit(webinar.webinar_id)
     return webinar
 
 
+def _webinar_values(data):
+    """
+    Преобразует значения колонок Webinar из формата api (строки) в формат базы данных.
+    Время начала округляется до целых минут, как в create_webinar
+    :param data: dictionary column name -> value, only columns of Webinar
+    :return dict: new dictionary
+    """
+    values = dict(data)
+    if values.get('begin_date'):
+        values['begin_date'] = datetime.strptime(values['begin_date'][:16], '%Y-%m-%dT%H:%M')
+    if values.get('duration'):
+        hrs, mins = map(int, values['duration'].split(':'))
+        values['duration'] = timedelta(hours=hrs, minutes=mins)
+    if values.get('upload_date'):
+        values['upload_date'] = parse_date(values['upload_date'])
+    if values.get('vimeo_id'):
+        values['vimeo_id'] = int(values['vimeo_id'])
+    return values
+
+
+def _new_webinar_row(initiator, data):
+    """
+    Строит значения колонок нового вебинара для bulk_insert_mappings.
+    Вебинары CLICKMEETING сохраняются без комнаты в статусе CREATED, комната создается в create_webinar_in_clm
+    """
+    row = _webinar_values({name: data[name] for name in _webinar_input_columns() if name in data})
+    if data['webinar_type'] == 'MANUALLY_UPLOADED':
+        row.update(status='UPLOADED', begin_date=None, created_at=None)
+    else:
+        row.update(status='CREATED' if data['webinar_type'] == 'CLICKMEETING' else 'PLANNED',
+                   created_at=datetime.now())
+    row.update(initiator_lect_id=initiator.lect_id, version=1, updated_at=datetime.now())
+    return row
+
+
+def _webinar_input_columns():
+    # webinar_id, версия и время изменения поддерживаются сервером
+    return [column.name for column in Webinar.__table__.columns
+            if column.name not in ('webinar_id', 'version', 'updated_at', 'room_requested_at')]
+
+
+def _insert_webinar_tags(pairs, replace=False):
+    """
+    Сохраняет продукты, предметы и курсы вебинаров пакетными INSERT
+    :param pairs: list of pairs (webinar_id, data), where data may contain lists products, subjects, courses
+    :param bool replace: delete old values of the properties presented in data
+    """
+    for name, (model, column) in webinar_tag_models.items():
+        webinar_ids = [webinar_id for webinar_id, data in pairs if name in data]
+        if replace and webinar_ids:
+            model.query.filter(model.webinar_id.in_(webinar_ids)).delete(synchronize_session=False)
+        rows = [{'webinar_id': webinar_id, column: value}
+                for webinar_id, data in pairs for value in data.get(name) or []]
+        if rows:
+            session.bulk_insert_mappings(model, rows)
+
+
+def validate_webinars_post(post_type, items):
+    """
+    Проверяет все вебинары пакета, см. validate_webinar_post
+    :return: pair (ok, reasons), where reasons maps index of invalid item to the reason
+    """
+    reasons = {}
+    for index, data in enumerate(items):
+        ok, reason = validate_webinar_post(post_type, data)
+        if not ok:
+            reasons[index] = reason
+    return not reasons, reasons
+
+
+def create_webinars(initiator, items):
+    """
+    Создает пакет вебинаров в одной транзакции.
+    Комнаты в ClickMeeting и токены для всех вебинаров создаются одной фоновой задачей create_webinars_in_clm
+    :param items: list of webinars data, checked by validate_webinars_post
+    :return list: ids of created webinars in order of items
+    """
+    rows = [_new_webinar_row(initiator, data) for data in items]
+    # return_defaults заполняет webinar_id в rows: id нужны для связанных таблиц
+    session.bulk_insert_mappings(Webinar, rows, return_defaults=True)
+    _insert_webinar_tags([(row['webinar_id'], data) for row, data in zip(rows, items)])
+    session.commit()
+    invalidate_webinar_caches()
+
+    clm_webinar_ids = [row['webinar_id'] for row in rows if row['webinar_type'] == 'CLICKMEETING']
+    if clm_webinar_ids:
+        create_webinars_in_clm.submit(clm_webinar_ids)
+    return [row['webinar_id'] for row in rows]
+
+
+# Через это время незавершенное создание комнаты (например, остановленным процессом) может быть начато заново.
+#  Больше времени ожидания ограничителя частоты и ответа ClickMeeting
+_ROOM_REQUEST_TIMEOUT = timedelta(minutes=5)
+
+
+def create_webinar_in_clm(webinar_id):
+    """
+    Создает комнату в ClickMeeting для вебинара, сохраненного без нее (статус CREATED).
+    Для вебинара, у которого уже есть комната или комнату которого сейчас создает другой процесс, ничего не делает:
+     в этом случае у возвращенного вебинара room_id может быть None
+    """
+    if not _claim_room_request(webinar_id):
+        return get_webinar(webinar_id)
+    webinar = get_webinar(webinar_id)
+    hrs, mins = divmod(int(webinar.duration.total_seconds()) // 60, 60)
+    try:
+        response = clm_service.post_conference({
+            'name': webinar.name,
+            'is_closed': webinar.is_closed,
+            'description': webinar.description,
+            'start_date': webinar.begin_date.strftime('%Y-%m-%dT%H:%M:%S'),
+            'duration': '{}:{:02}'.format(hrs, mins),
+            'cm_account_login': webinar.cm_account_login,
+        })
+    except Exception:
+        # Комната не создана, следующая попытка может быть сделана сразу
+        session.rollback()
+        _set_room_requested_at(webinar_id, None)
+        raise
+    webinar.room_id = response['room']['id']
+    webinar.webinar_link = response['room']['room_url']
+    touch_webinar(webinar)
+    session.add(webinar)
+    session.commit()
+    invalidate_webinar_caches()
+    return webinar
+
+
+def _claim_room_request(webinar_id):
+    """
+    Отмечает начало создания комнаты вебинара одним условным UPDATE. Задача webinar_status_change
+     и create_webinars_in_clm могут обрабатывать один вебинар одновременно, но комнату создаст только одна из них
+    :return bool: True if the webinar has no room and nobody else is creating it
+    """
+    now = datetime.now()
+    claimed = _set_room_requested_at(webinar_id, now, or_(Webinar.room_requested_at.is_(None),
+                                                          Webinar.room_requested_at < now - _ROOM_REQUEST_TIMEOUT))
+    return claimed == 1
+
+
+def _set_room_requested_at(webinar_id, value, *criteria):
+    # Служебная отметка не является изменением вебинара: версия и updated_at остаются прежними
+    updated = Webinar.query.filter(Webinar.webinar_id == webinar_id, Webinar.room_id.is_(None), *criteria).update(
+        {Webinar.room_requested_at: value, Webinar.updated_at: Webinar.updated_at}, synchronize_session=False)
+    session.commit()
+    return updated
+
+
+def _plan_webinar_in_clm(webinar_id):
+    if create_webinar_in_clm(webinar_id).room_id is None:
+        # Комнату создает другой процесс, он же переводит вебинар в PLANNED
+        return
+    update_web_status(webinar_id, 'PLANNED')
+    create_or_update_webinars_tokens(webinar_id)
+
+
+@executor.job
+def create_webinars_in_clm(webinar_ids):
+    """
+    Создает комнаты в ClickMeeting и токены для вебинаров, созданных пакетом.
+    Вебинары обрабатываются конкурентно, не больше CLM_CONCURRENCY одновременно.
+    Вебинары, для которых это не удалось, остаются в статусе CREATED и обрабатываются задачей webinar_status_change
+    """
+    logger.info('Creating %s webinars in clm', len(webinar_ids))
+    results = clm_async.get_clm_client().run_many(_plan_webinar_in_clm, [(webinar_id,) for webinar_id in webinar_ids])
+    for webinar_id, result in zip(webinar_ids, results):
+        if isinstance(result, Exception):
+            logger.error('Error while creating webinar #%s in clm: %s', webinar_id, result)
+    logger.info('Creating webinars in clm completed')
+
+
 def update_webinar(webinar_id, data):
     webinar = get_webinar(webinar_id)
 
-    attrs = [column.name for column in Webinar.__table__.columns]
+    # Версия, время изменения и время создания комнаты поддерживаются сервером
+    attrs = [column.name for column in Webinar.__table__.columns
+             if column.name not in ('version', 'updated_at', 'room_requested_at')]
     for attr in attrs:
         if attr in data:
             setattr(webinar, attr, data[attr])
+    touch_webinar(webinar)
 
     session.add(webinar)
     session.commit()
+    invalidate_webinar_caches()
     return webinar
 
 
+def validate_webinars_patch(items):
+    """
+    Проверяет все изменения пакета, см. validate_webinar_patch. Вебинары загружаются одним запросом
+    :param items: list of dicts with webinar_id and changed fields
+    :return: pair (ok, reasons), where reasons maps index of invalid item to the reason
+    """
+    webinars = {webinar.webinar_id: webinar for webinar in
+                Webinar.query.filter(Webinar.webinar_id.in_([data.get('webinar_id') for data in items]))}
+    reasons = {}
+    seen = set()
+    for index, data in enumerate(items):
+        webinar_id = data.get('webinar_id')
+        if webinar_id not in webinars:
+            reasons[index] = 'Webinar {} not found'.format(webinar_id)
+            continue
+        if webinar_id in seen:
+            reasons[index] = 'Webinar {} is repeated'.format(webinar_id)
+            continue
+        seen.add(webinar_id)
+        ok, reason = _validate_webinar_patch(webinars[webinar_id],
+                                             {name: value for name, value in data.items() if name != 'webinar_id'})
+        if not ok:
+            reasons[index] = reason
+    return not reasons, reasons
+
+
+def update_webinars(items):
+    """
+    Изменяет пакет вебинаров в одной транзакции.
+    Вебинары с одинаковым набором изменяемых полей изменяются одним UPDATE (executemany), версии увеличиваются
+    :param items: list of dicts with webinar_id and changed fields, checked by validate_webinars_patch
+    :return list: ids of changed webinars in order of items
+    """
+    table = Webinar.__table__
+    columns = _webinar_input_columns()
+    groups = defaultdict(list)
+    for data in items:
+        values = _webinar_values({name: value for name, value in data.items() if name in columns})
+        groups[tuple(sorted(values))].append(dict(values, b_webinar_id=data['webinar_id']))
+
+    # Изменяемые колонки берутся из параметров, поэтому параметр с id назван иначе
+    statement = table.update().where(table.c.webinar_id == bindparam('b_webinar_id'))\
+        .values(version=table.c.version + 1, updated_at=datetime.now())
+    for params in groups.values():
+        session.execute(statement, params)
+    _insert_webinar_tags([(data['webinar_id'], data) for data in items], replace=True)
+    session.commit()
+    invalidate_webinar_caches()
+    return [data['webinar_id'] for data in items]
+
+
 def delete_webinar(webinar_id):
     webinar = get_webinar(webinar_id)
     clm_service.delete_conference(webinar.room_id, webinar.cm_account_login)
     session.delete(webinar)
     session.commit()
+    invalidate_webinar_caches()
 
 
 def send_notification_about_beginning(webinar_id):
@@ -159,7 +794,10 @@ def validate_webinar_delete(webinar_id):
 
 
 def validate_webinar_patch(webinar_id, data):
-    webinar = get_webinar(webinar_id)
+    return _validate_webinar_patch(get_webinar(webinar_id), data)
+
+
+def _validate_webinar_patch(webinar, data):
     if webinar.status == 'PLANNED':
         allowed_fields = ['name', 'description', 'preview_url', 'message_for_students',
                           'subjects', 'courses', 'products']
@@ -0,0 +1,50 @@
+"""
+Tests use SQLite in memory instead of MySQL. Settings required by config.py get harmless defaults,
+ so tests can be started without .env file:
+    $ python -m pytest tests
+
+The tests need the whole application. This repository contains only a part of it: the User model (with its
+ profile), privileges_required and the models imported by utils/update_aggregated.py are defined elsewhere,
+ and lectarium_app.models relies on the import order of the full application. lectarium_app also imports
+ werkzeug.contrib, which the pinned Werkzeug 1.0.0 does not have. So `import lectarium_app` fails, and the tests
+ can not be collected in this repository alone.
+"""
+import os
+import sqlite3
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('MYSQL_USERNAME', 'test')
+os.environ.setdefault('MYSQL_PASSWORD', 'test')
+os.environ.setdefault('MYSQL_HOSTNAME', 'localhost')
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@event.listens_for(Engine, 'connect')
+def _create_mysql_collation(dbapi_connection, connection_record):
+    # Columns of models are declared with MySQL collation, SQLite compares such strings as binary
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_collation('utf8mb4_unicode_ci', lambda a, b: (a > b) - (a < b))
+
+
+import pytest
+
+from lectarium_app import app as flask_app, db
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+
+
+@pytest.fixture
+def session(app):
+    """
+    Session of the application with empty tables
+    """
+    db.create_all()
+    yield db.session
+    db.session.remove()
+    db.drop_all()
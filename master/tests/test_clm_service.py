@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_clm_server import make_server
+from lectarium_app import clm_service
+from lectarium_app.exceptions import ClmOperationalError, TokenLimitError
+from lectarium_app.models.webinar_entities import CmAccount
+from lectarium_app.utils import RateLimiter
+
+LOGIN = 'test'
+
+
+@pytest.fixture
+def clm(app, session, monkeypatch):
+    """
+    Local fake ClickMeeting API on an ephemeral port. Its FakeClickMeeting object is returned,
+     options (latency, error_rate, tokens_limit) can be changed by the test.
+    """
+    session.add(CmAccount(login=LOGIN, api_key='key', status=1, userplan=10))
+    session.commit()
+    server = make_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+
+    monkeypatch.setitem(app.config, 'CLM_URL', 'http://127.0.0.1:{}/v1'.format(server.server_address[1]))
+    monkeypatch.setitem(app.config, 'CLM_RETRIES', 2)
+    monkeypatch.setitem(app.config, 'CLM_RETRY_BACKOFF', 0.05)
+    monkeypatch.setattr(clm_service, 'rate_limiter', RateLimiter(0))
+    # Sessions are created with the configuration above
+    clm_service._http_sessions.clear()
+    clm_service.invalidate_accounts()
+    yield server.fake
+
+    server.shutdown()
+    server.server_close()
+    clm_service._http_sessions.clear()
+    clm_service.invalidate_accounts()
+
+
+def create_room(clm):
+    return clm_service.post_conference({
+        'name': 'test', 'is_closed': False, 'description': '', 'start_date': '2030-01-01T12:00:00',
+        'duration': '1:00', 'cm_account_login': LOGIN,
+    })['room']['id']
+
+
+def test_connections_are_kept_alive(clm):
+    room_id = create_room(clm)
+    clm_service.generate_tokens(room_id, LOGIN, 2)
+    clm_service.get_tokens(room_id, LOGIN)
+
+    http_session = clm_service.get_http_session()
+    assert clm_service.get_http_session() is http_session
+    pool = http_session.get_adapter(clm_service.app.config['CLM_URL']).poolmanager\
+        .connection_from_url(clm_service.app.config['CLM_URL'])
+    assert pool.num_requests == 3
+    assert pool.num_connections == 1
+
+
+def test_read_timeout_raises_operational_error(clm, monkeypatch):
+    monkeypatch.setitem(clm_service.app.config, 'CLM_READ_TIMEOUT', 0.1)
+    monkeypatch.setitem(clm_service.app.config, 'CLM_RETRIES', 0)
+    clm.latency = 0.5
+    with pytest.raises(ClmOperationalError):
+        clm_service.get_tokens(1, LOGIN)
+
+
+@pytest.mark.parametrize('method, send', [
+    ('GET', lambda: clm_service.get_tokens(1, LOGIN)),
+    ('PUT', lambda: clm_service.edit_conference(1, LOGIN, {'name': 'test'})),
+    ('DELETE', lambda: clm_service.delete_conference(1, LOGIN)),
+])
+def test_idempotent_requests_are_retried_with_backoff(clm, method, send):
+    clm.error_rate = 1
+    start = time.monotonic()
+    with pytest.raises(ClmOperationalError):
+        send()
+    # Two retries, the second one is delayed at least by CLM_RETRY_BACKOFF * 2
+    assert time.monotonic() - start >= 0.1
+    assert [request_method for request_method, _ in clm.requests] == [method] * 3
+
+
+def test_post_is_not_retried(clm):
+    clm.error_rate = 1
+    with pytest.raises(ClmOperationalError):
+        clm_service.generate_tokens(1, LOGIN, 1)
+    assert clm.requests == [('POST', '/conferences/1/tokens')]
+
+
+def test_token_limit_raises_token_limit_error(clm):
+    clm.tokens_limit = 5
+    room_id = create_room(clm)
+    assert len(clm_service.generate_tokens(room_id, LOGIN, 3)) == 3
+
+    with pytest.raises(TokenLimitError) as error:
+        clm_service.generate_tokens(room_id, LOGIN, 3)
+    _, generated, allowed = error.value.args
+    assert (generated, allowed, error.value.status_code) == (3, 5, 403)
+    assert len(clm_service.get_tokens(room_id, LOGIN)) == 3
+
+
+def test_each_retry_takes_rate_limit_token(clm, monkeypatch):
+    monkeypatch.setattr(clm_service, 'rate_limiter', RateLimiter(1000, burst=100))
+    clm.error_rate = 1
+    with pytest.raises(ClmOperationalError):
+        clm_service.get_tokens(1, LOGIN)
+    assert clm_service.rate_limiter.stats()[LOGIN]['acquired'] == len(clm.requests) == 3
+
+
+@pytest.mark.parametrize('status_code, message', [
+    (429, 'Rate limit is 100 requests per 60 s'),
+    (503, 'Unable to generate more tokens for this conference, 3 tokens are generated, 3 requested and limit is 5'),
+    (403, 'Room 12 is locked since 2030'),
+])
+def test_other_errors_are_not_token_limit(monkeypatch, status_code, message):
+    def send_request(*args):
+        raise ClmOperationalError(json.dumps({'errors': [{'message': message}]}), status_code=status_code)
+    monkeypatch.setattr(clm_service, 'send_request', send_request)
+
+    with pytest.raises(ClmOperationalError) as error:
+        clm_service.generate_tokens(1, LOGIN, 3)
+    assert not isinstance(error.value, TokenLimitError)
+    assert error.value.status_code == status_code
@@ -0,0 +1,44 @@
+import pytest
+
+from lectarium_app.exceptions import SecurityError
+from lectarium_app.models.webinar_entities import Webinar, WebinarToken
+from lectarium_app.utils import ColumnarMixin
+
+pyarrow = pytest.importorskip('pyarrow')
+
+STATUSES = Webinar.__table__.columns['status'].type.enums
+
+
+def read_stream(chunks):
+    return pyarrow.ipc.open_stream(b''.join(chunks)).read_all()
+
+
+@pytest.fixture
+def webinars(session):
+    # Batches of two rows get different sets of statuses in different order
+    statuses = ['FINISHED', 'PLANNED', 'CREATED', 'PLANNED', 'AVAILABLE', 'FINISHED', 'IN_PROGRESS']
+    session.add_all([Webinar(name='webinar {}'.format(i), status=status, webinar_type=None if i == 3 else 'YOUTUBE')
+                     for i, status in enumerate(statuses)])
+    session.commit()
+    return statuses
+
+
+def test_enum_columns_share_one_dictionary(webinars):
+    args = {'filter': None, 'order_by': 'webinar_id'}
+    table = read_stream(ColumnarMixin(Webinar).stream_arrow(args, xfields=['status', 'webinar_type'], batch_size=2))
+
+    assert table.column('status').num_chunks == 4
+    for chunk in table.column('status').chunks:
+        assert chunk.dictionary.to_pylist() == list(STATUSES)
+    assert table.column('status').to_pylist() == webinars
+    assert table.combine_chunks().column('status').to_pylist() == webinars
+    assert table.column('webinar_type').to_pylist() == ['YOUTUBE'] * 3 + [None] + ['YOUTUBE'] * 3
+
+
+def test_autologin_hash_is_not_exported(session):
+    exporter = ColumnarMixin(WebinarToken)
+    assert 'autologin_hash' not in exporter.columnar_fields()
+    with pytest.raises(SecurityError):
+        exporter.stream_arrow({'filter': None, 'order_by': None}, xfields=['autologin_hash'])
+    with pytest.raises(SecurityError):
+        exporter.stream_arrow({'filter': 'autologin_hash == "hash"', 'order_by': None})
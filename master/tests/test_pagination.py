@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+
+import pytest
+from flask_restplus import marshal
+from sqlalchemy import event
+
+from lectarium_app import db, webinar_service
+from lectarium_app.models.webinar_entities import Webinar, WebinarProduct, WebinarSubject, WebinarCourse
+from lectarium_app.serializers import webinar_full_model
+from lectarium_app.utils import PaginationMixin
+
+
+class WebinarPages(PaginationMixin):
+    BaseEntity = Webinar
+    preloaded_properties = webinar_service.webinar_preloaded_properties
+
+
+@contextmanager
+def count_selects():
+    """
+    Collects SELECT statements executed inside the block
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def webinars(session):
+    for i in range(100):
+        webinar = Webinar(name='webinar {}'.format(i), status='PLANNED', webinar_type='CLICKMEETING')
+        session.add_all([
+            webinar,
+            WebinarProduct(webinar=webinar, product='product {}'.format(i)),
+            WebinarSubject(webinar=webinar, subject='math'),
+            WebinarSubject(webinar=webinar, subject='physics'),
+            WebinarCourse(webinar=webinar, course='course {}'.format(i % 10)),
+        ])
+    session.commit()
+    session.expunge_all()
+
+
+def marshal_page(size):
+    args = {'page': 1, 'size': size, 'offset': 0, 'filter': None, 'order_by': 'webinar_id', 'fields': None}
+    with count_selects() as statements:
+        payload = marshal(WebinarPages().paginate(args), webinar_full_model)
+    db.session.expunge_all()
+    return payload, len(statements)
+
+
+def test_tags_are_loaded_with_constant_number_of_queries(webinars):
+    one, queries_for_one = marshal_page(1)
+    hundred, queries_for_hundred = marshal_page(100)
+
+    assert len(one) == 1 and len(hundred) == 100
+    assert hundred[99]['subjects'] == ['math', 'physics']
+    assert hundred[99]['products'] == ['product 99']
+    assert hundred[99]['courses'] == ['course 9']
+    # The page itself and one query per preloaded relationship
+    assert queries_for_one == queries_for_hundred == 1 + len(WebinarPages.preloaded_properties)
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from lectarium_app import clm_service, webinar_service
+from lectarium_app.exceptions import ClmOperationalError
+from lectarium_app.models.webinar_entities import Webinar
+
+
+@pytest.fixture
+def webinar_id(session):
+    webinar = Webinar(name='webinar', status='CREATED', webinar_type='CLICKMEETING', cm_account_login='test',
+                      begin_date=datetime(2030, 1, 1, 12), duration=timedelta(hours=1))
+    session.add_all([webinar, Webinar(name='other', status='PLANNED', webinar_type='YOUTUBE')])
+    session.commit()
+    return webinar.webinar_id
+
+
+def test_get_all_webs_by_status(webinar_id):
+    assert [webinar.webinar_id for webinar in webinar_service.get_all_webs_by_status('CREATED')] == [webinar_id]
+
+
+def test_room_is_created_once(webinar_id, monkeypatch):
+    requests = []
+
+    def post_conference(params):
+        requests.append(params)
+        # The scheduled job comes while the first request is in progress
+        assert webinar_service.create_webinar_in_clm(webinar_id).room_id is None
+        return {'room': {'id': 42, 'room_url': 'https://example.com/42'}}
+    monkeypatch.setattr(clm_service, 'post_conference', post_conference)
+
+    webinar = webinar_service.create_webinar_in_clm(webinar_id)
+    assert (webinar.room_id, webinar.version) == (42, 2)
+    assert webinar_service.create_webinar_in_clm(webinar_id).room_id == 42
+    assert len(requests) == 1
+
+
+def test_failed_room_request_is_retried(webinar_id, monkeypatch):
+    def post_conference(params):
+        raise ClmOperationalError('Service unavailable')
+    monkeypatch.setattr(clm_service, 'post_conference', post_conference)
+    with pytest.raises(ClmOperationalError):
+        webinar_service.create_webinar_in_clm(webinar_id)
+
+    monkeypatch.setattr(clm_service, 'post_conference',
+                        lambda params: {'room': {'id': 42, 'room_url': 'https://example.com/42'}})
+    assert webinar_service.create_webinar_in_clm(webinar_id).room_id == 42
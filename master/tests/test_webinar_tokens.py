@@ -0,0 +1,129 @@
+import pytest
+from sqlalchemy import event
+
+from lectarium_app import clm_service, db, webinar_service
+from lectarium_app.exceptions import ClmOperationalError
+from lectarium_app.models.webinar_entities import CmAccount, Webinar, WebinarToken, WebinarTokenPool
+
+
+@pytest.fixture
+def webinar(app, session, monkeypatch):
+    # Pools are not refilled in background during these tests
+    monkeypatch.setitem(app.config, 'TOKEN_POOL_LOW_WATERMARK', 0)
+    webinar = Webinar(name='webinar', status='PLANNED', webinar_type='CLICKMEETING', room_id=1)
+    session.add(webinar)
+    session.flush()
+    session.add_all([WebinarToken(webinar_id=webinar.webinar_id, token='token{}'.format(i)) for i in range(5)])
+    session.commit()
+    return webinar
+
+
+def tokens_of(webinar):
+    return {wtoken.lect_id: wtoken.token for wtoken in WebinarToken.query.filter_by(webinar_id=webinar.webinar_id)
+            if wtoken.lect_id is not None}
+
+
+def test_failed_autologin_hashes_are_not_requested_again(webinar, session, monkeypatch):
+    monkeypatch.setattr(clm_service, 'autologin_params', lambda lect_user, token: {'token': token})
+    for wtoken in WebinarToken.query.order_by(WebinarToken.id).limit(4):
+        wtoken.lect_id = wtoken.id
+    session.commit()
+    requested = []
+
+    def request_autologin_hash(cm_account_login, room_id, params):
+        requested.append(params['token'])
+        if params['token'] in ('token0', 'token1'):
+            raise ClmOperationalError('Invalid token')
+        return 'hash of ' + params['token']
+    monkeypatch.setattr(clm_service, 'request_autologin_hash', request_autologin_hash)
+
+    assert webinar_service.precompute_autologin_hashes(2) == (0, 2)
+    assert webinar_service.precompute_autologin_hashes(2) == (2, 0)
+    assert webinar_service.precompute_autologin_hashes(2) == (0, 0)
+    assert requested == ['token0', 'token1', 'token2', 'token3']
+    assert [wtoken.autologin_hash for wtoken in WebinarToken.query.order_by(WebinarToken.id)] == \
+        [None, None, 'hash of token2', 'hash of token3', None]
+
+
+def test_refill_does_not_hold_transaction_during_clickmeeting_request(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'TOKEN_POOL_REFILL_BATCH', 10)
+    monkeypatch.setitem(app.config, 'TOKEN_POOL_HIGH_WATERMARK', 15)
+    session.add(CmAccount(login='test', api_key='key', status=1, userplan=10))
+    webinar = Webinar(name='webinar', status='PLANNED', webinar_type='CLICKMEETING', room_id=1, cm_account_login='test')
+    session.add(webinar)
+    session.flush()
+    webinar_id = webinar.webinar_id
+    session.commit()
+
+    checked_out = []
+
+    def checkout(*args):
+        checked_out.append(args[0])
+
+    def checkin(*args):
+        checked_out.remove(args[0])
+    event.listen(db.engine, 'checkout', checkout)
+    event.listen(db.engine, 'checkin', checkin)
+    requested = []
+
+    def generate_tokens(room_id, cm_account_login, how_many):
+        # The pool row is locked until the end of a transaction, so a connection must not be in use
+        assert not checked_out
+        requested.append(how_many)
+        return ['{}-{}'.format(len(requested), i) for i in range(how_many)]
+    monkeypatch.setattr(clm_service, 'generate_tokens', generate_tokens)
+
+    try:
+        assert webinar_service.refill_token_pool(webinar_id) == 15
+    finally:
+        event.remove(db.engine, 'checkout', checkout)
+        event.remove(db.engine, 'checkin', checkin)
+    assert requested == [10, 5]
+    pool = WebinarTokenPool.query.get(webinar_id)
+    assert (pool.size, pool.claimed, pool.allowed) == (15, 0, 40)
+
+
+def test_reserve_tokens_skips_users_with_tokens(webinar):
+    first = webinar_service.claim_token(webinar.webinar_id, 1)
+
+    assert webinar_service.reserve_tokens(webinar.webinar_id, [1, 2, 3, 2]) == []
+    tokens = tokens_of(webinar)
+    assert sorted(tokens) == [1, 2, 3]
+    assert tokens[1] == first.token
+    assert len(set(tokens.values())) == 3
+
+
+def test_reserve_tokens_returns_users_without_free_tokens(webinar):
+    assert webinar_service.reserve_tokens(webinar.webinar_id, [1, 2, 3, 4, 5, 6, 7]) == [6, 7]
+    assert sorted(tokens_of(webinar)) == [1, 2, 3, 4, 5]
+    assert webinar_service.claim_token(webinar.webinar_id, 6) is None
+
+
+def test_join_uses_precomputed_hash(webinar, session, monkeypatch):
+    webinar_service.reserve_tokens(webinar.webinar_id, [1])
+    wtoken = WebinarToken.query.filter_by(webinar_id=webinar.webinar_id, lect_id=1).one()
+    wtoken.autologin_hash = 'precomputed'
+    session.commit()
+
+    def request_hash(*args):
+        raise AssertionError('ClickMeeting should not be requested')
+    monkeypatch.setattr(clm_service, 'get_autologin_hash', request_hash)
+
+    user = type('User', (), {'lect_id': 1})()
+    claimed = webinar_service.claim_token(webinar.webinar_id, user.lect_id)
+    assert webinar_service.get_autologin_hash(webinar, user, claimed) == 'precomputed'
+
+
+@pytest.mark.parametrize('status, room_id', [('CREATED', None), ('PLANNED', None), ('FINISHED', 1)])
+def test_webinars_without_tokens_are_not_refilled(session, monkeypatch, status, room_id):
+    webinar = Webinar(name='webinar', status=status, webinar_type='CLICKMEETING', room_id=room_id,
+                      cm_account_login='test')
+    session.add(webinar)
+    session.commit()
+
+    def generate_tokens(*args):
+        raise AssertionError('ClickMeeting should not be requested')
+    monkeypatch.setattr(clm_service, 'generate_tokens', generate_tokens)
+
+    assert not webinar_service.can_have_tokens(webinar)
+    assert webinar_service.refill_token_pool(webinar.webinar_id) == 0